@@ -0,0 +1,11 @@
+"""Core package behind the ATS CV enhancement apps.
+
+`cv_ats.pipeline.get_pipeline(profile)` gives the enhancement pipeline for a
+prompt profile (see cv_ats.profiles) and `cv_ats.ui` is the Streamlit page
+the app_*.py scripts run. Importing the package itself loads nothing else.
+
+    python -m cv_ats.batch ...           # headless batch mode
+    python -m cv_ats.bench ...           # latency/throughput benchmark
+    python -m cv_ats.startup_bench ...   # import-time and per-rerun overhead
+    python -m cv_ats.ranking_index ...   # maintain the CV ranking index
+"""
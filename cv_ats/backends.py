@@ -0,0 +1,297 @@
+"""Model backends.
+
+Every backend exposes `generate_content(prompt, stream=False)` with the same
+shape as `google.generativeai.GenerativeModel`: the result has `.text` and
+`.usage_metadata`, and with `stream=True` it is an iterable of chunks that
+each have `.text`. This lets the pipeline swap the Gemini client for a
+local stand-in that needs no network access.
+
+`get_backend()` picks the implementation from CV_BACKEND ("gemini" by
+default, or "fake"). The fake backend is configured with FAKE_LATENCY,
+FAKE_JITTER, FAKE_MS_PER_TOKEN, FAKE_ERROR_RATE, FAKE_ERROR_STATUS,
+FAKE_MAX_CONCURRENT (answer 429 beyond this many requests in flight) and
+FAKE_REPLAY (a file written by RecordingBackend). Setting CV_RECORD_PATH
+records every real prompt/response pair for later replay. Every call is
+metered (latency, outcome, token usage, see metrics.py) and the backend is
+wrapped in the quota-aware scheduler from scheduler.py unless
+LLM_SCHEDULER=0.
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from .llm_cache import normalize_text
+from .metrics import record_model_call
+from .prompt_templates import estimate_tokens
+from .streaming import cancel_stream
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(normalize_text(prompt).encode("utf-8")).hexdigest()
+
+
+class ModelBackend:
+    model_name = None
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        raise NotImplementedError
+
+
+class GeminiBackend(ModelBackend):
+    def __init__(self, model_name, api_key=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+
+                genai.configure(api_key=self.api_key)
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        return self._get_model().generate_content(prompt, stream=stream, **kwargs)
+
+
+class FakeBackendError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or "Simulated upstream error (HTTP %d)" % status)
+        self.status = status
+        self.code = status
+
+
+class FakeResponse:
+    def __init__(self, text, prompt_tokens):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=estimate_tokens(text),
+            total_token_count=prompt_tokens + estimate_tokens(text),
+        )
+
+
+class FakeStream:
+    def __init__(self, backend, text, prompt_tokens):
+        self._backend = backend
+        self._text = text
+        self._cancelled = threading.Event()
+        self.usage_metadata = FakeResponse(text, prompt_tokens).usage_metadata
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        backend = self._backend
+        # Like the real service, a streamed request is rejected when the first chunk is requested
+        backend._enter()
+        try:
+            backend._sleep(backend.latency, backend.jitter)
+            step = backend.chunk_chars
+            for start in range(0, len(self._text), step):
+                if self._cancelled.is_set():
+                    return
+                chunk = self._text[start:start + step]
+                backend._sleep(backend.ms_per_token * estimate_tokens(chunk) / 1000.0)
+                yield SimpleNamespace(text=chunk)
+        finally:
+            backend._exit()
+
+
+class FakeBackend(ModelBackend):
+    """Local stand-in that replays recorded responses and injects latency and errors.
+
+    Latency is `latency` seconds (plus up to `jitter`) before the first token
+    and `ms_per_token` for each output token, so long outputs take longer just
+    like the real service. Prompts without a recorded response get
+    `responder(prompt)`, or a deterministic filler of `output_tokens` tokens.
+    With `max_concurrent`, requests beyond that many in flight fail with 429,
+    which is how a per-minute quota looks under a burst of load.
+    """
+
+    def __init__(self, model_name="fake", latency=0.0, jitter=0.0, ms_per_token=0.0,
+                 error_rate=0.0, error_status=503, output_tokens=400, replay=None,
+                 responder=None, chunk_chars=64, seed=None, max_concurrent=0):
+        self.model_name = model_name
+        self.latency = latency
+        self.jitter = jitter
+        self.ms_per_token = ms_per_token
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.output_tokens = output_tokens
+        self.responder = responder
+        self.chunk_chars = chunk_chars
+        self.max_concurrent = max_concurrent
+        self.calls = 0
+        self.throttled = 0
+        self.total_prompt_tokens = 0
+        self.total_output_tokens = 0
+        self._responses = {}
+        self._in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if replay:
+            self.load_recording(replay)
+
+    def load_recording(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._responses[record["key"]] = record["text"]
+
+    def respond(self, prompt):
+        recorded = self._responses.get(prompt_key(prompt))
+        if recorded is not None:
+            return recorded
+        if self.responder is not None:
+            return self.responder(prompt)
+        return self.filler(prompt)
+
+    def filler(self, prompt):
+        words = ["improved"] * max(1, self.output_tokens)
+        return "Fake response for a %d-token prompt.\n%s" % (estimate_tokens(prompt), " ".join(words))
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.error_rate
+            jitter = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+        if fail:
+            self._sleep(self.latency)
+            raise FakeBackendError(self.error_status)
+        text = self.respond(prompt)
+        if not stream:
+            self._enter()
+        with self._lock:
+            self.total_prompt_tokens += estimate_tokens(prompt)
+            self.total_output_tokens += estimate_tokens(text)
+        if stream:
+            return FakeStream(self, text, estimate_tokens(prompt))
+        try:
+            self._sleep(self.latency + jitter + self.ms_per_token * estimate_tokens(text) / 1000.0)
+        finally:
+            self._exit()
+        return FakeResponse(text, estimate_tokens(prompt))
+
+    def _enter(self):
+        with self._lock:
+            if self.max_concurrent and self._in_flight >= self.max_concurrent:
+                self.throttled += 1
+                raise FakeBackendError(429, "Simulated quota exceeded (HTTP 429)")
+            self._in_flight += 1
+
+    def _exit(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _sleep(self, seconds, jitter=0.0):
+        if jitter:
+            with self._lock:
+                seconds += self._random.uniform(0, jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class RecordingBackend(ModelBackend):
+    """Wraps another backend and appends every prompt/response pair to a JSONL file for FakeBackend."""
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.path = path
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if stream:
+            # Streams are recorded by the non-streaming path only; replay serves both
+            return self.inner.generate_content(prompt, stream=True, **kwargs)
+        response = self.inner.generate_content(prompt, **kwargs)
+        record = {"key": prompt_key(prompt), "model": self.model_name, "text": response.text}
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return response
+
+
+class MeteredStream:
+    def __init__(self, backend, inner):
+        self._backend = backend
+        self._inner = inner
+
+    @property
+    def usage_metadata(self):
+        return getattr(self._inner, "usage_metadata", None)
+
+    def cancel(self):
+        cancel_stream(self._inner)
+
+    def __iter__(self):
+        started = time.perf_counter()
+        error = None
+        try:
+            for chunk in self._inner:
+                yield chunk
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            # Gemini only fills in usage_metadata once the stream has been consumed
+            usage = None if error is not None else self.usage_metadata
+            record_model_call(self._backend.model_name, time.perf_counter() - started, usage, error)
+
+
+class MeteredBackend(ModelBackend):
+    """Wraps another backend and records the latency, outcome and token usage of every call."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.model_name = inner.model_name
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.inner.generate_content(prompt, stream=stream, **kwargs)
+        except Exception as exc:
+            record_model_call(self.model_name, time.perf_counter() - started, error=exc)
+            raise
+        if stream:
+            return MeteredStream(self, response)
+        record_model_call(self.model_name, time.perf_counter() - started, getattr(response, "usage_metadata", None))
+        return response
+
+
+def get_backend(model_name):
+    kind = os.getenv("CV_BACKEND", "gemini").lower()
+    if kind == "fake":
+        backend = FakeBackend(
+            model_name=model_name,
+            latency=float(os.getenv("FAKE_LATENCY", "0")),
+            jitter=float(os.getenv("FAKE_JITTER", "0")),
+            ms_per_token=float(os.getenv("FAKE_MS_PER_TOKEN", "0")),
+            error_rate=float(os.getenv("FAKE_ERROR_RATE", "0")),
+            error_status=int(os.getenv("FAKE_ERROR_STATUS", "503")),
+            max_concurrent=int(os.getenv("FAKE_MAX_CONCURRENT", "0")),
+            replay=os.getenv("FAKE_REPLAY") or None,
+        )
+    elif kind == "gemini":
+        backend = GeminiBackend(model_name, api_key=os.getenv("GOOGLE_API_KEY"))
+    else:
+        raise ValueError("Unknown CV_BACKEND %r (expected 'gemini' or 'fake')" % kind)
+    record_path = os.getenv("CV_RECORD_PATH")
+    if record_path:
+        backend = RecordingBackend(backend, record_path)
+    backend = MeteredBackend(backend)
+    if os.getenv("LLM_SCHEDULER", "1") != "0":
+        # Imported here: scheduler.py builds on this module
+        from .scheduler import ScheduledBackend, get_scheduler
+
+        backend = ScheduledBackend(backend, get_scheduler(model_name))
+    return backend
@@ -0,0 +1,234 @@
+"""Headless batch mode: run a folder of CVs against a set of job descriptions.
+
+    python -m cv_ats.batch --cvs cvs/ --jobs jobs.json --out results.jsonl --concurrency 8
+
+Extraction runs in a process pool, model calls in a bounded thread pool, and
+every finished item is appended to the output JSONL straight away. Rerunning
+the same command skips items already recorded with status "ok", so a crashed
+run resumes where it stopped. Without --jobs only the general enhancement is
+produced.
+
+The jobs file is a JSON list (or JSONL) of objects with "id",
+"job_description" and "minimum_qualification". With --index and --top-k,
+each job is only tailored for its k best-matching CVs according to a
+ranking index built with cv_ats.ranking_index. --metrics writes the run's
+metrics (stage latencies, model tokens, cache hits) in the Prometheus text
+format when it finishes. Model calls spend the batch quota, BATCH_LLM_RPM
+and BATCH_LLM_TPM, rather than the UI's (see scheduler.py).
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from .metrics import prometheus_text, request
+from .pdf_cache import pdf_text_cache, read_upload
+from .pdf_extract import extract_text
+from .pipeline import get_pipeline
+from .profiles import PROFILES
+from .scheduler import BATCH, set_priority, use_batch_budget
+from .specific_modes import MODES
+
+GENERAL_JOB = {"id": "general", "job_description": None, "minimum_qualification": None}
+
+
+def load_jobs(path):
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read().strip()
+    if raw.startswith("["):
+        jobs = json.loads(raw)
+    else:
+        jobs = [json.loads(line) for line in raw.splitlines() if line.strip()]
+    for i, job in enumerate(jobs):
+        job.setdefault("id", "job-%d" % i)
+        if not job.get("job_description") or not job.get("minimum_qualification"):
+            raise ValueError("Job %r needs both job_description and minimum_qualification" % job["id"])
+    return jobs
+
+
+def load_completed(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash can leave a truncated last line; that item is simply redone
+                continue
+            if record.get("status") == "ok":
+                done.add((record["cv"], record["job_id"]))
+    return done
+
+
+def ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def extract_cv(path):
+    # Runs in a worker process; extraction is the same for every prompt profile
+    with open(path, "rb") as f:
+        return pdf_text_cache.get_or_extract(read_upload(f), extract_text)
+
+
+def run_job(pipeline, cv_text, job, mode=None):
+    if job["id"] == GENERAL_JOB["id"]:
+        return pipeline.improve_cv_general(cv_text)
+    return pipeline.improve_cv_specific(cv_text, job["job_description"], job["minimum_qualification"], mode)
+
+
+class BatchRunner:
+    def __init__(self, profile, out_path, concurrency=4, extract_workers=None, mode=None):
+        self.pipeline = get_pipeline(profile)
+        self.out_path = out_path
+        self.concurrency = concurrency
+        self.extract_workers = extract_workers
+        self.mode = mode
+        self.failures = 0
+        self._results = queue.Queue()
+
+    def run(self, pdf_paths, jobs, shortlist=None):
+        done = load_completed(self.out_path)
+        pending = {}
+        for path in pdf_paths:
+            todo = [
+                job for job in jobs
+                if (path, job["id"]) not in done
+                and (shortlist is None or job["id"] not in shortlist or path in shortlist[job["id"]])
+            ]
+            if todo:
+                pending[path] = todo
+        expected = sum(len(todo) for todo in pending.values())
+        print("%d items to process" % expected, file=sys.stderr)
+        if not expected:
+            return 0
+
+        writer = threading.Thread(target=self._write_results, args=(expected,))
+        writer.start()
+        # Every model call from these threads queues behind interactive requests from the UI
+        with ThreadPoolExecutor(max_workers=self.concurrency, initializer=set_priority, initargs=(BATCH,)) as model_pool:
+            self._model_pool = model_pool
+            with ProcessPoolExecutor(max_workers=self.extract_workers) as extract_pool:
+                futures = {extract_pool.submit(extract_cv, path): path for path in pending}
+                for future in as_completed(futures):
+                    path = futures[future]
+                    try:
+                        cv_text = future.result()
+                    except Exception as exc:
+                        for job in pending[path]:
+                            self._record(path, job, error=exc)
+                        continue
+                    model_pool.submit(self._process_cv, path, cv_text, pending[path])
+            # _process_cv keeps submitting tailoring jobs, so wait for the writer before the pool shuts down
+            writer.join()
+        return self.failures
+
+    def _process_cv(self, path, cv_text, todo):
+        if self.mode == "fused" and all(job["id"] != GENERAL_JOB["id"] for job in todo):
+            # Fused calls don't build on a general pass, so there is nothing to share
+            for job in todo:
+                self._model_pool.submit(self._process_job, path, cv_text, job)
+            return
+        # Run the general pass once so every tailoring call for this CV reuses it from the response cache
+        started = time.perf_counter()
+        try:
+            with request("batch-general"):
+                general = self.pipeline.improve_cv_general(cv_text)
+        except Exception as exc:
+            for job in todo:
+                self._record(path, job, error=exc)
+            return
+        for job in todo:
+            if job["id"] == GENERAL_JOB["id"]:
+                self._record(path, job, output=general, elapsed=time.perf_counter() - started)
+            else:
+                self._model_pool.submit(self._process_job, path, cv_text, job)
+
+    def _process_job(self, path, cv_text, job):
+        started = time.perf_counter()
+        try:
+            with request("batch-general" if job["id"] == GENERAL_JOB["id"] else "batch-specific"):
+                output = run_job(self.pipeline, cv_text, job, self.mode)
+        except Exception as exc:
+            self._record(path, job, error=exc)
+            return
+        self._record(path, job, output=output, elapsed=time.perf_counter() - started)
+
+    def _record(self, path, job, output=None, error=None, elapsed=None):
+        record = {"cv": path, "job_id": job["id"], "profile": self.pipeline.profile.name}
+        if error is not None:
+            record.update(status="error", error="%s: %s" % (type(error).__name__, error))
+        else:
+            record.update(status="ok", output=output, elapsed=round(elapsed, 3))
+        self._results.put(record)
+
+    def _write_results(self, expected):
+        with open(self.out_path, "a", encoding="utf-8") as out:
+            if not ends_with_newline(self.out_path):
+                # Don't glue the first new record onto a line truncated by a crash
+                out.write("\n")
+            for n in range(1, expected + 1):
+                record = self._results.get()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                if record["status"] != "ok":
+                    self.failures += 1
+                print("[%d/%d] %s %s %s" % (n, expected, record["status"], record["cv"], record["job_id"]), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Improve a folder of CVs in batch.")
+    parser.add_argument("--cvs", required=True, help="Directory containing PDF CVs")
+    parser.add_argument("--jobs", help="JSON/JSONL file of job descriptions; omit for general enhancement only")
+    parser.add_argument("--out", required=True, help="Output JSONL file (appended to, used for resuming)")
+    parser.add_argument("--profile", "--app", dest="profile",
+                        help="Prompt profile (%s) or former app module name" % ", ".join(PROFILES))
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum concurrent model calls")
+    parser.add_argument("--mode", choices=MODES, help="Execution mode for job-specific enhancement")
+    parser.add_argument("--index", help="Ranking index directory (see cv_ats.ranking_index)")
+    parser.add_argument("--top-k", type=int, help="Only tailor each job for its k best-ranked CVs; needs --jobs and --index")
+    parser.add_argument("--extract-workers", type=int, default=None, help="Processes used for PDF extraction")
+    parser.add_argument("--metrics", help="Write Prometheus-format metrics for the run to this file")
+    args = parser.parse_args(argv)
+    if args.top_k and not args.jobs:
+        # The general enhancement has no job description to rank against
+        parser.error("--top-k needs --jobs")
+    use_batch_budget()
+
+    jobs = load_jobs(args.jobs) if args.jobs else [GENERAL_JOB]
+    pdf_paths = sorted(
+        os.path.join(args.cvs, name) for name in os.listdir(args.cvs) if name.lower().endswith(".pdf")
+    )
+    shortlist = None
+    if args.top_k:
+        if not args.index:
+            parser.error("--top-k needs --index")
+        from .ranking_index import RankingIndex
+
+        ranked = RankingIndex.load(args.index).top_k_many([job["job_description"] or "" for job in jobs], args.top_k)
+        by_abspath = {os.path.abspath(path): path for path in pdf_paths}
+        shortlist = {
+            job["id"]: {by_abspath[doc_id] for doc_id, _ in matches if doc_id in by_abspath}
+            for job, matches in zip(jobs, ranked)
+        }
+    runner = BatchRunner(args.profile, args.out, concurrency=args.concurrency, extract_workers=args.extract_workers, mode=args.mode)
+    failures = runner.run(pdf_paths, jobs, shortlist)
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""Latency/throughput benchmark for the CV pipeline, run against the fake backend.
+
+    python -m cv_ats.bench --profile thirty-section --requests 40 --concurrency 1 4 16 --latency 0.2
+
+Reports p50/p95 end-to-end latency, requests per second and model tokens
+per request for PDF extraction, prompt building, the general flow and the
+job-specific flow in each execution mode, at each concurrency level.
+The general_edits stage runs the general enhancement in edit-operation
+mode (see edits.py); the fake model answers it with a few edits of the CV
+and everything else with --output-tokens tokens, roughly a rewritten CV.
+Model calls go to a FakeBackend with the given latency profile and the
+response cache is bypassed, so the numbers reflect the pipeline itself
+and can be compared between commits.
+
+With --scheduler the fake backend sits behind the quota-aware scheduler;
+combined with --fake-max-concurrent (or --error-status 429) this shows how
+retries and the adaptive concurrency limit behave under throttling:
+
+    python -m cv_ats.bench --stages general --concurrency 16 --scheduler --fake-max-concurrent 4
+
+With --routing the pipeline routes between a fake lite and a fake pro model
+(--pro-slowdown times slower, see routing.py); the routing decisions and
+per-model calls, time and tokens are printed after the results:
+
+    python -m cv_ats.bench --stages general specific --routing
+
+The specific_fanout stage tailors the CV for --targets job descriptions in
+one request (see Pipeline.improve_cv_specific_many); specific_each makes
+the same number of separate job-specific requests one after another.
+"""
+
+import argparse
+import json
+import logging
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .backends import FakeBackend, MeteredBackend
+from .llm_cache import response_cache
+from .metrics import model_totals, registry
+from .pdf_extract import extract_text
+from .pipeline import get_pipeline
+from .profiles import PROFILES
+from .routing import Router
+from .scheduler import ScheduledBackend, Scheduler
+
+SAMPLE_CV = """Jane Doe
+jane.doe@example.com | linkedin.com/in/janedoe
+
+Experience
+Data Analyst, Example Corp (01/2020 - Present)
+- Built dashboards for the sales team
+- Automated monthly reporting in Python and SQL
+- Worked with stakeholders to define KPIs
+
+Education
+BSc Statistics, Example University (2019)
+
+Skills
+Python, SQL, Excel, Tableau, communication
+"""
+
+SAMPLE_JOB = "Senior data analyst to own reporting, build Tableau dashboards and partner with finance."
+SAMPLE_QUALIFICATION = "3+ years of SQL and Python; CPA or finance background a plus."
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100.0 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def make_sample_pdf(pages=2):
+    import fitz
+
+    doc = fitz.open()
+    try:
+        for _ in range(pages):
+            page = doc.new_page()
+            page.insert_text((72, 72), SAMPLE_CV, fontsize=10)
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+
+def run_stage(fn, requests, concurrency, backends, scheduler=None):
+    latencies = []
+    errors = 0
+
+    def timed(_):
+        started = time.perf_counter()
+        fn()
+        return time.perf_counter() - started
+
+    prompt_tokens = sum(backend.total_prompt_tokens for backend in backends)
+    output_tokens = sum(backend.total_output_tokens for backend in backends)
+    retries = scheduler.counters["retries"] if scheduler else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(timed, i) for i in range(requests)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    wall = time.perf_counter() - started
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "rps": len(latencies) / wall if wall else float("inf"),
+        "errors": errors,
+        "prompt_tokens": (sum(backend.total_prompt_tokens for backend in backends) - prompt_tokens) / requests,
+        "output_tokens": (sum(backend.total_output_tokens for backend in backends) - output_tokens) / requests,
+        "retries": (scheduler.counters["retries"] - retries) if scheduler else 0,
+        "limit": scheduler.limit if scheduler else concurrency,
+    }
+
+
+def edit_responder(backend, cv_text):
+    # Edit prompts get a valid edit list touching a few lines of the CV; everything else gets the filler
+    lines = [line.strip() for line in cv_text.splitlines() if len(line.strip()) > 20][:5]
+    response = json.dumps({
+        "edits": [{"op": "replace", "find": line, "text": "Improved: " + line} for line in lines],
+        "changes": ["Rewrote %d bullet points with action verbs" % len(lines)],
+        "suggestions": ["Quantify the remaining achievements"],
+    })
+
+    def respond(prompt):
+        return response if '{"edits": [' in prompt else backend.filler(prompt)
+
+    return respond
+
+
+def sample_targets(count):
+    return [("%s (role %d)" % (SAMPLE_JOB, i + 1), SAMPLE_QUALIFICATION) for i in range(count)]
+
+
+def build_stages(pipeline, pdf_bytes, cv_text, targets):
+    stages = {}
+    if pdf_bytes is not None:
+        stages["extract"] = lambda: extract_text(pdf_bytes)
+    stages["prompt_build"] = lambda: pipeline.build_general_prompt(cv_text)
+    stages["general"] = lambda: pipeline.improve_cv_general(cv_text, "full")
+    stages["general_edits"] = lambda: pipeline.improve_cv_general(cv_text, "edits")
+    # The same job-specific enhancement in each execution mode, for comparison with the two-step path
+    stages["specific"] = lambda: pipeline.improve_cv_specific(cv_text, SAMPLE_JOB, SAMPLE_QUALIFICATION, "sequential")
+    stages["specific_fused"] = lambda: pipeline.improve_cv_specific(cv_text, SAMPLE_JOB, SAMPLE_QUALIFICATION, "fused")
+    stages["specific_overlapped"] = lambda: pipeline.improve_cv_specific(
+        cv_text, SAMPLE_JOB, SAMPLE_QUALIFICATION, "overlapped"
+    )
+    # One CV against several jobs: a single general pass and concurrent tailoring, against separate requests
+    stages["specific_fanout"] = lambda: [
+        result.output for result in pipeline.improve_cv_specific_many(cv_text, sample_targets(targets), "overlapped")
+    ]
+    stages["specific_each"] = lambda: [
+        pipeline.improve_cv_specific(cv_text, job, qualification, "overlapped")
+        for job, qualification in sample_targets(targets)
+    ]
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CV pipeline against a fake model backend.")
+    parser.add_argument("--profile", "--app", dest="profile",
+                        help="Prompt profile to benchmark (%s)" % ", ".join(PROFILES))
+    parser.add_argument("--pdf", help="PDF to use for the extraction stage (default: a generated sample)")
+    parser.add_argument("--pages", type=int, default=2, help="Pages in the generated sample PDF")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per stage and concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--stages", nargs="+", help="Only run these stages")
+    parser.add_argument("--targets", type=int, default=5, help="Job descriptions per specific_fanout request")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake time to first token, in seconds")
+    parser.add_argument("--ms-per-token", type=float, default=2.0, help="Fake generation time per output token")
+    parser.add_argument("--output-tokens", type=int, default=400, help="Fake output tokens of a full response")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of the injected errors")
+    parser.add_argument("--fake-max-concurrent", type=int, default=0,
+                        help="Fake backend answers 429 beyond this many requests in flight")
+    parser.add_argument("--scheduler", action="store_true", help="Put the quota-aware scheduler in front")
+    parser.add_argument("--rpm", type=int, default=0, help="Scheduler requests-per-minute limit")
+    parser.add_argument("--tpm", type=int, default=0, help="Scheduler tokens-per-minute limit")
+    parser.add_argument("--retry-delay", type=float, default=0.2, help="Scheduler base backoff, in seconds")
+    parser.add_argument("--routing", action="store_true", help="Route between a fake lite and a fake pro model")
+    parser.add_argument("--pro-slowdown", type=float, default=2.0, help="Latency factor of the fake pro model")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per result instead of a table")
+    args = parser.parse_args(argv)
+    # Keep retry warnings from the scheduler out of the results table
+    logging.basicConfig(level=logging.ERROR)
+
+    pipeline = get_pipeline(args.profile)
+    pipeline.router = Router() if args.routing else None
+    if args.routing:
+        slowdowns = {pipeline.router.lite_model: 1.0, pipeline.router.pro_model: args.pro_slowdown}
+    else:
+        slowdowns = {pipeline.model_name: 1.0}
+    scheduler = None
+    if args.scheduler:
+        scheduler = Scheduler(
+            rpm=args.rpm, tpm=args.tpm, max_concurrency=max(args.concurrency), base_delay=args.retry_delay
+        )
+    backends = []
+    for model_name, slowdown in slowdowns.items():
+        backend = FakeBackend(
+            model_name=model_name,
+            latency=args.latency * slowdown,
+            ms_per_token=args.ms_per_token * slowdown,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+            max_concurrent=args.fake_max_concurrent,
+            output_tokens=args.output_tokens,
+            seed=0,
+        )
+        backends.append(backend)
+        model = MeteredBackend(backend)
+        pipeline.backends[model_name] = ScheduledBackend(model, scheduler) if scheduler else model
+    response_cache.bypass = True
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            pdf_bytes = f.read()
+    else:
+        try:
+            pdf_bytes = make_sample_pdf(args.pages)
+        except ImportError:
+            pdf_bytes = None
+            print("PyMuPDF not installed, skipping the extract stage", file=sys.stderr)
+    cv_text = extract_text(pdf_bytes) if pdf_bytes is not None else SAMPLE_CV
+    for backend in backends:
+        backend.responder = edit_responder(backend, cv_text)
+
+    stages = build_stages(pipeline, pdf_bytes, cv_text, args.targets)
+    if args.stages:
+        stages = {name: fn for name, fn in stages.items() if name in args.stages}
+
+    if not args.json:
+        print("%-20s %5s %10s %10s %9s %6s %10s %10s %7s %6s" % (
+            "stage", "conc", "p50 ms", "p95 ms", "req/s", "errors", "tok in", "tok out", "retries", "limit"))
+    for name, fn in stages.items():
+        for concurrency in args.concurrency:
+            result = run_stage(fn, args.requests, concurrency, backends, scheduler)
+            if args.json:
+                print(json.dumps(dict(stage=name, concurrency=concurrency, profile=pipeline.profile.name, **result)))
+            else:
+                print("%-20s %5d %10.2f %10.2f %9.1f %6d %10.0f %10.0f %7d %6.1f" % (
+                    name, concurrency, result["p50_ms"], result["p95_ms"], result["rps"], result["errors"],
+                    result["prompt_tokens"], result["output_tokens"], result["retries"], result["limit"]))
+    if args.routing:
+        report_routing(args.json)
+    return 0
+
+
+def report_routing(as_json):
+    decisions = [
+        (dict(labels), count) for (name, labels), count in sorted(registry.snapshot().items())
+        if name == "cv_route_decisions_total"
+    ]
+    totals = model_totals()
+    if as_json:
+        for labels, count in decisions:
+            print(json.dumps(dict(route=labels, count=count)))
+        for model_name, values in sorted(totals.items()):
+            print(json.dumps(dict(model=model_name, **values)))
+        return
+    print()
+    print("%-12s %-28s %-14s %8s" % ("step", "model", "reason", "count"))
+    for labels, count in decisions:
+        print("%-12s %-28s %-14s %8d" % (labels["step"], labels["model"], labels["reason"], count))
+    print()
+    print("%-28s %8s %10s %10s %10s" % ("model", "calls", "mean ms", "tok in", "tok out"))
+    for model_name, values in sorted(totals.items()):
+        calls = values.get("calls", 0)
+        print("%-28s %8d %10.1f %10.0f %10.0f" % (
+            model_name, calls, values.get("seconds", 0) / calls * 1000 if calls else 0,
+            values.get("prompt_tokens", 0), values.get("output_tokens", 0)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""Edit-operation output mode for the general enhancement.
+
+A full rewrite costs as many output tokens as the CV is long, and output
+tokens are the slowest part of a model call. In this mode the model instead
+returns a short JSON list of targeted edits against the extracted text:
+
+    {"edits": [{"op": "replace", "find": "...", "text": "..."},
+               {"op": "insert_after", "find": "...", "text": "..."},
+               {"op": "delete", "find": "..."},
+               {"op": "add_to_section", "section": "Skills", "text": "..."}],
+     "changes": ["..."], "suggestions": ["..."]}
+
+The response is checked against EDIT_SCHEMA, the edits are applied locally
+(`apply_edits`) and the result is rendered like a full response. Output
+that is not valid JSON, does not match the schema, or whose edits mostly
+fail to locate their text raises EditError; `improve_with_edits` then falls
+back to the full regeneration. `cv_ats.bench --stages general general_edits`
+compares the two.
+"""
+
+import json
+import os
+import re
+from collections import namedtuple
+
+from .llm_cache import make_key, response_cache
+from .metrics import inc
+from .prompt_templates import compile_template
+from .sections import is_text_heading
+
+OUTPUT_MODES = ("full", "edits")
+DEFAULT_OUTPUT = os.getenv("GENERAL_OUTPUT", "full")
+MAX_EDITS = int(os.getenv("EDIT_MAX_OPERATIONS", "40"))
+# Below this share of edits applied the plan is treated as malformed
+MIN_APPLIED_SHARE = float(os.getenv("EDIT_MIN_APPLIED_SHARE", "0.5"))
+
+EditPlan = namedtuple("EditPlan", "edits changes suggestions")
+EditResult = namedtuple("EditResult", "text applied skipped")
+EditedCV = namedtuple("EditedCV", "text applied skipped fallback")
+
+_TEXT = {"type": "string", "minLength": 1}
+_TEXT_LIST = {"type": "array", "items": {"type": "string"}}
+
+# A JSON Schema, so it can also be handed to a model API that enforces one
+EDIT_SCHEMA = {
+    "type": "object",
+    "required": ["edits"],
+    "properties": {
+        "edits": {
+            "type": "array",
+            "maxItems": MAX_EDITS,
+            "items": {
+                "type": "object",
+                "required": ["op"],
+                "properties": {
+                    "op": {"type": "string", "enum": ["replace", "insert_after", "delete", "add_to_section"]},
+                    "find": _TEXT,
+                    "section": _TEXT,
+                    "text": {"type": "string"},
+                },
+            },
+        },
+        "changes": _TEXT_LIST,
+        "suggestions": _TEXT_LIST,
+    },
+}
+
+# The fields each operation needs, on top of the schema
+OPERATION_FIELDS = {
+    "replace": ("find", "text"),
+    "insert_after": ("find", "text"),
+    "delete": ("find",),
+    "add_to_section": ("section", "text"),
+}
+
+EDITS_PROMPT_VERSION = "edits-v2"
+
+EDITS_TEMPLATE = compile_template("edits", EDITS_PROMPT_VERSION, """
+    As an ATS (Applicant Tracking System) and CV enhancement expert, improve the following CV for ATS compatibility with targeted edits instead of rewriting it:
+    - Start bullet points with action verbs. {metrics_instruction}
+    - Integrate relevant keywords naturally, including both long-form and acronym versions (e.g., "certified public accountant" and "CPA").
+    - Correct typos, grammar and inconsistent formatting, e.g. date formats.
+    - Keep every fact, employer, title and date; do not invent new roles or qualifications.
+
+    Reply with a single JSON object and nothing else, in this form:
+    {{"edits": [
+      {{"op": "replace", "find": "<text copied exactly from the CV>", "text": "<replacement>"}},
+      {{"op": "insert_after", "find": "<line copied exactly from the CV>", "text": "<new line>"}},
+      {{"op": "delete", "find": "<text copied exactly from the CV>"}},
+      {{"op": "add_to_section", "section": "<section heading as written in the CV>", "text": "<line to add at the end of it>"}}
+    ],
+    "changes": ["<one key change per item>"],
+    "suggestions": ["<one further suggestion per item>"]}}
+
+    Every "find" must be copied verbatim from the CV and occur only once in it; prefer whole bullet points or lines. Use at most {max_edits} edits and leave text that needs no change out.
+
+    ### Original CV:
+    {cv_text}
+    """, weights={"cv_text": 10, "max_edits": 1, "metrics_instruction": 1})
+
+# Asks the Gemini API for a bare JSON body; other backends ignore it
+GENERATION_CONFIG = {"response_mime_type": "application/json"}
+
+_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+# What may precede deleted text on its line for the whole line to go with it
+_LINE_PREFIX = re.compile(r"[ \t]*(?:[-*\u2022\u25aa\u25e6]|\d+[.)])?[ \t]*")
+
+
+class EditError(ValueError):
+    """The model's edit list is unusable; `reason` is "json", "schema" or "unapplied"."""
+
+    def __init__(self, reason, message):
+        super().__init__(reason, message)
+        self.reason = reason
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+_TYPES = {"object": dict, "array": list, "string": str}
+
+
+def validate(value, schema=EDIT_SCHEMA, path="$"):
+    """Check `value` against the subset of JSON Schema used by EDIT_SCHEMA, raising EditError."""
+    expected = _TYPES[schema["type"]]
+    if not isinstance(value, expected):
+        raise EditError("schema", "%s: expected %s" % (path, schema["type"]))
+    if "enum" in schema and value not in schema["enum"]:
+        raise EditError("schema", "%s: %r is not one of %s" % (path, value, ", ".join(schema["enum"])))
+    if "minLength" in schema and len(value) < schema["minLength"]:
+        raise EditError("schema", "%s: empty string" % path)
+    if "maxItems" in schema and len(value) > schema["maxItems"]:
+        raise EditError("schema", "%s: more than %d items" % (path, schema["maxItems"]))
+    if expected is list:
+        for i, item in enumerate(value):
+            validate(item, schema["items"], "%s[%d]" % (path, i))
+    elif expected is dict:
+        for key in schema.get("required", ()):
+            if key not in value:
+                raise EditError("schema", "%s: missing %r" % (path, key))
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                validate(value[key], subschema, "%s.%s" % (path, key))
+
+
+def parse_edits(response):
+    """Parse and validate a model response into an EditPlan."""
+    try:
+        data = json.loads(_FENCE.sub("", response))
+    except ValueError as exc:
+        raise EditError("json", "response is not JSON: %s" % exc) from exc
+    validate(data)
+    for i, edit in enumerate(data["edits"]):
+        for field in OPERATION_FIELDS[edit["op"]]:
+            if field not in edit:
+                raise EditError("schema", "$.edits[%d]: %r needs %r" % (i, edit["op"], field))
+    return EditPlan(data["edits"], data.get("changes", []), data.get("suggestions", []))
+
+
+def _locate(text, find):
+    start = text.find(find)
+    if start >= 0:
+        return start, start + len(find)
+    # PDF extraction and the model rarely agree on whitespace
+    words = find.split()
+    if not words:
+        return None
+    match = re.search(r"\s+".join(re.escape(word) for word in words), text)
+    return (match.start(), match.end()) if match else None
+
+
+def _section_end(text, section):
+    title = section.strip().rstrip(":").lower()
+    lines = text.split("\n")
+    offset = 0
+    start = None
+    for line in lines:
+        if start is None:
+            if line.strip().rstrip(":").lower() == title:
+                start = offset
+        elif is_text_heading(line):
+            break
+        offset += len(line) + 1
+    if start is None:
+        return None
+    # Just after the section's last non-blank line
+    return len(text[:offset].rstrip())
+
+
+def apply_edit(text, edit):
+    """Return `text` with one edit applied, or None if its anchor can't be found."""
+    op = edit["op"]
+    if op == "add_to_section":
+        end = _section_end(text, edit["section"])
+        return None if end is None else text[:end] + "\n" + edit["text"] + text[end:]
+    span = _locate(text, edit["find"])
+    if span is None:
+        return None
+    start, end = span
+    if op == "replace":
+        return text[:start] + edit["text"] + text[end:]
+    if op == "insert_after":
+        line_end = text.find("\n", end)
+        line_end = len(text) if line_end < 0 else line_end
+        return text[:line_end] + "\n" + edit["text"] + text[line_end:]
+    # delete: when only a bullet or indentation would be left, the line goes with its line break
+    line_start = text.rfind("\n", 0, start) + 1
+    line_end = text.find("\n", end)
+    line_end = len(text) if line_end < 0 else line_end
+    if _LINE_PREFIX.fullmatch(text[line_start:start]) and not text[end:line_end].strip():
+        start = line_start
+        if line_end < len(text):
+            end = line_end + 1
+        else:
+            end = line_end
+            start = max(0, line_start - 1)
+    return text[:start] + text[end:]
+
+
+def apply_edits(text, edits):
+    """Apply edits in order; those whose text can't be found are skipped."""
+    applied = skipped = 0
+    for edit in edits:
+        edited = apply_edit(text, edit)
+        if edited is None:
+            skipped += 1
+        else:
+            text = edited
+            applied += 1
+    return EditResult(text, applied, skipped)
+
+
+def render(cv_text, plan):
+    """Apply `plan` to `cv_text` and lay the result out like a full response."""
+    result = apply_edits(cv_text, plan.edits)
+    if plan.edits and result.applied < MIN_APPLIED_SHARE * len(plan.edits):
+        raise EditError("unapplied", "only %d of %d edits could be applied" % (result.applied, len(plan.edits)))
+    parts = ["### Improved CV", result.text.strip()]
+    if plan.changes:
+        parts += ["### Key Changes", "\n".join("- " + change for change in plan.changes)]
+    if plan.suggestions:
+        parts += ["### Suggestions", "\n".join("- " + suggestion for suggestion in plan.suggestions)]
+    return EditResult("\n\n".join(parts), result.applied, result.skipped)
+
+
+def improve_with_edits(model, model_name, cv_text, fallback, metrics_instruction, cache=response_cache):
+    """Enhance `cv_text` through an edit list, calling `fallback()` for a full rewrite when it is unusable.
+
+    `metrics_instruction` is the profile's rule for quantifying bullets (see
+    profiles.py). Only validated responses are cached, so a malformed one is
+    asked for again next time.
+    """
+    key = make_key(model_name, EDITS_PROMPT_VERSION, metrics_instruction, cv_text)
+    response = cache.get(key)
+    cached = response is not None
+    if not cached:
+        prompt = EDITS_TEMPLATE.render(
+            cv_text=cv_text, max_edits=str(MAX_EDITS), metrics_instruction=metrics_instruction
+        )
+        response = model.generate_content(prompt.text, generation_config=GENERATION_CONFIG).text
+    try:
+        result = render(cv_text, parse_edits(response))
+    except EditError as exc:
+        inc("cv_edit_fallbacks_total", reason=exc.reason)
+        return EditedCV(fallback(), 0, 0, exc.reason)
+    if not cached:
+        cache.put(key, model_name, EDITS_PROMPT_VERSION, response)
+    inc("cv_edits_applied_total", result.applied)
+    inc("cv_edits_skipped_total", result.skipped)
+    return EditedCV(result.text, result.applied, result.skipped, None)
@@ -0,0 +1,262 @@
+"""Background jobs for the model calls.
+
+Streamlit reruns the page script on every interaction, and work running
+inline under `st.spinner` is thrown away with it. The pages instead submit a
+job here and poll it. The runner is a module-level singleton of an imported
+module, so it and its jobs outlive reruns, and the job id the page keeps in
+its URL lets a reconnected browser pick the result back up.
+
+Job ids are derived from the request (model, prompt version, inputs), so an
+identical request made while one is in flight, from another tab or another
+user, gets the existing job instead of a second upstream call
+(singleflight). Finished jobs are kept for JOB_RESULT_TTL seconds, at most
+JOB_MAX_FINISHED of them; JOB_WORKERS bounds how many run at once. Each job
+is one request for metrics.py, optionally profiled. A job can also stream
+several steps at once into named parts (one per target job description
+when tailoring for many), which `watch_parts` polls.
+
+Streamlit can't tell the job when the user presses Stop or leaves the
+page, so the page offers a Cancel button instead. `JobRunner.cancel`
+cancels a job only once every session that submitted or joined it has
+let go. A cancelled job closes its current stream, which cancels the
+upstream request (see streaming.py), and starts no further steps.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from .llm_cache import make_key
+from .metrics import request
+from .streaming import RESTART, GenerationTimings
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's steps once the job has been cancelled."""
+
+
+def job_key(model_name, template_version, *inputs):
+    return make_key(model_name, template_version, *inputs)[:32]
+
+
+class Job:
+    def __init__(self, job_id, label="", profile=None):
+        self.id = job_id
+        self.label = label
+        self.profile = profile
+        self.metrics = None
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.detail = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.step = None
+        self.steps = OrderedDict()
+        self.timings = OrderedDict()
+        self.part_errors = {}
+        # Sessions waiting for the result; guarded by the runner's lock
+        self.sessions = set()
+        self._chunks = []
+        self._parts = OrderedDict()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._cancelled = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Stop the job at its next chunk or step; use JobRunner.cancel from a page."""
+        self._cancelled.set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise JobCancelled("cancelled")
+
+    @property
+    def partial(self):
+        """The text streamed so far by the current step."""
+        with self._lock:
+            return "".join(self._chunks)
+
+    def stream(self, step, stream_fn):
+        """Run one streamed step, `stream_fn(timings)`, exposing its chunks to pollers as they arrive."""
+        self.check_cancelled()
+        timings = self.timings[step] = GenerationTimings()
+        with self._lock:
+            self.step = step
+            self._chunks = []
+        # Closing the stream on cancellation cancels the upstream request
+        with closing(stream_fn(timings)) as chunks:
+            for chunk in chunks:
+                self.check_cancelled()
+                with self._lock:
+                    if chunk is RESTART:
+                        self._chunks = []
+                    else:
+                        self._chunks.append(chunk)
+        self.steps[step] = text = self.partial
+        return text
+
+    def stream_part(self, name, stream_fn):
+        """Like stream, for one of several steps running at the same time; its chunks go to part `name`."""
+        self.check_cancelled()
+        timings = self.timings[name] = GenerationTimings()
+        with self._lock:
+            parts = self._parts[name] = []
+        with closing(stream_fn(timings)) as chunks:
+            for chunk in chunks:
+                self.check_cancelled()
+                with self._lock:
+                    if chunk is RESTART:
+                        parts.clear()
+                    else:
+                        parts.append(chunk)
+        return self.part(name)
+
+    def set_part(self, name, text=None, error=None):
+        with self._lock:
+            self._parts[name] = [text] if text else []
+            if error is not None:
+                self.part_errors[name] = "%s: %s" % (type(error).__name__, error)
+
+    def part(self, name):
+        with self._lock:
+            return "".join(self._parts.get(name, ()))
+
+    def snapshot(self):
+        """The current step's partial text and the text of every part so far."""
+        with self._lock:
+            return "".join(self._chunks), {name: "".join(chunks) for name, chunks in self._parts.items()}
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+class JobRunner:
+    def __init__(self, max_workers=4, result_ttl=3600, max_finished=500):
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self.deduplicated = 0
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cv-job")
+
+    def submit(self, job_id, fn, label="", profile=None, session=None):
+        """Run `fn(job)` in the background and return the Job.
+
+        If a job with this id is queued, running or finished recently, that job
+        is returned instead; only a failed or cancelled job is run again.
+        `session` identifies the caller for `cancel`. `profile` ("cprofile" or
+        "tracemalloc") profiles the run, see metrics.request.
+        """
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+            if job is not None and job.status not in (FAILED, CANCELLED) and not job.cancelled:
+                self.deduplicated += 1
+                job.sessions.add(session)
+                return job
+            job = self._jobs[job_id] = Job(job_id, label, profile)
+            job.sessions.add(session)
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def cancel(self, job_id, session=None):
+        """Stop waiting for a job on behalf of `session`; the job is cancelled if no other session is waiting.
+
+        Returns whether the job was cancelled.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.sessions.discard(session)
+            if job.sessions:
+                return False
+            job.cancel()
+            return True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return dict(counts, deduplicated=self.deduplicated)
+
+    def _run(self, job, fn):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            with request(job.label or "job", profile=job.profile) as job.metrics:
+                try:
+                    job.check_cancelled()
+                    job.result = fn(job)
+                    status = DONE
+                except JobCancelled:
+                    job.metrics.status = CANCELLED
+                    job.error = "Cancelled"
+                    status = CANCELLED
+        except Exception as exc:
+            logger.exception("job %s (%s) failed", job.id, job.label)
+            job.error = "%s: %s" % (type(exc).__name__, exc)
+            status = FAILED
+        # finished_at first: _expire reads it for any job whose status says it has finished
+        job.finished_at = time.time()
+        job.status = status
+        job._done.set()
+
+    def _expire(self, now):
+        finished = [job for job in self._jobs.values() if job.finished]
+        for i, job in enumerate(finished):
+            if now - job.finished_at > self.result_ttl or i < len(finished) - self.max_finished:
+                del self._jobs[job.id]
+
+
+def watch(job, interval=0.2):
+    """Yield the job's partial text every `interval` seconds, changed or not, until the job has finished.
+
+    Streamlit only acts on a click (such as Cancel) at the script's next
+    call into it, so the page must draw something on every poll, also while
+    a job is queued or runs a step that doesn't stream.
+    """
+    while True:
+        finished = job.wait(interval)
+        yield job.partial
+        if finished:
+            return
+
+
+def watch_parts(job, interval=0.2):
+    """Like watch, for jobs with parts: yield `job.snapshot()` on every poll until the job has finished."""
+    while True:
+        finished = job.wait(interval)
+        yield job.snapshot()
+        if finished:
+            return
+
+
+job_runner = JobRunner(
+    max_workers=int(os.getenv("JOB_WORKERS", "4")),
+    result_ttl=float(os.getenv("JOB_RESULT_TTL", "3600")),
+    max_finished=int(os.getenv("JOB_MAX_FINISHED", "500")),
+)
@@ -0,0 +1,160 @@
+"""Local keyword-coverage analysis between a CV and a job description.
+
+Everything here is set-based and runs in milliseconds, so the UI can show
+coverage as soon as the job description is entered, and the tailoring
+prompt can carry just the missing terms instead of the whole job
+description. Acronyms and their long forms ("CPA" / "certified public
+accountant") count as the same term, whichever one each text uses.
+"""
+
+import re
+import time
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+# Common pairs; pairs written as "Long Form (LF)" in either text are picked up too
+ACRONYMS = {
+    "ai": "artificial intelligence",
+    "api": "application programming interface",
+    "aws": "amazon web services",
+    "bi": "business intelligence",
+    "cfa": "chartered financial analyst",
+    "cpa": "certified public accountant",
+    "crm": "customer relationship management",
+    "erp": "enterprise resource planning",
+    "etl": "extract transform load",
+    "gaap": "generally accepted accounting principles",
+    "gcp": "google cloud platform",
+    "hr": "human resources",
+    "kpi": "key performance indicator",
+    "mba": "master of business administration",
+    "ml": "machine learning",
+    "nlp": "natural language processing",
+    "pmp": "project management professional",
+    "qa": "quality assurance",
+    "seo": "search engine optimization",
+    "sql": "structured query language",
+    "ux": "user experience",
+}
+
+STOPWORDS = frozenset("""
+    a about above across after all also an and any are as at be been being both but by can could did do does
+    during each either etc for from had has have having he her here his how i if in into is it its just least
+    may me more most must my no nor not of on one or other our out over own per plus preferred required
+    requirements responsibilities role same she should so some such than that the their them then there these
+    they this those through to too under until up us very via was we well were what when where which while who
+    whom why will with within without would you your
+    ability able candidate candidates company degree equivalent excellent experience experienced familiarity
+    good great ideal including job knowledge looking minimum new position qualification qualifications related
+    relevant skill skills strong team understanding work working year years
+    build hire hiring join junior opportunity plus seeking senior tools use using
+""".split())
+
+_WORD = re.compile(r"[a-z0-9][a-z0-9+#]*(?:[.\-/][a-z0-9+#]+)*")
+_DEFINED_ACRONYM = re.compile(r"((?:[A-Z][A-Za-z]+[\s-]+){1,5})\(([A-Z]{2,6})\)")
+_HAS_LETTER = re.compile(r"[a-z]")
+# Dots only inside a word ("Node.js"), so a pair never spans the end of a sentence
+_NAME_WORD = r"[A-Z][A-Za-z0-9+#]*(?:\.[A-Za-z0-9+#]+)*"
+_CAPITALIZED_PAIR = re.compile(r"\b(%s)[ \t]+(%s)\b" % (_NAME_WORD, _NAME_WORD))
+# Word pairs are only taken from within a clause
+_CLAUSE_BREAK = re.compile(r"[.;:!?](?=\s|$)|[,()\[\]\n\u2022]")
+
+CoverageReport = namedtuple("CoverageReport", "coverage matched missing elapsed_ms")
+
+
+def defined_acronyms(*texts):
+    """Find "Long Form (LF)" definitions whose initials spell the acronym."""
+    pairs = {}
+    for text in texts:
+        for long_form, acronym in _DEFINED_ACRONYM.findall(text or ""):
+            words = long_form.split()
+            words = words[len(words) - len(acronym):]
+            if len(words) == len(acronym) and "".join(w[0] for w in words).upper() == acronym:
+                pairs[acronym.lower()] = " ".join(words).lower()
+    return pairs
+
+
+@lru_cache(maxsize=256)
+def _long_forms(extra):
+    acronyms = dict(ACRONYMS, **dict(extra))
+    # Longest phrases first so "certified public accountant" wins over any shorter overlap
+    phrases = sorted(acronyms.values(), key=len, reverse=True)
+    # An optional plural, so "certified public accountants" is a CPA too
+    pattern = re.compile(r"\b(%s)s?\b" % "|".join(re.escape(p).replace(r"\ ", r"[\s-]+") for p in phrases))
+    return pattern, {v: k for k, v in acronyms.items()}
+
+
+def tokenize(text, acronyms=None):
+    """Lower-case word tokens with every known long form replaced by its acronym."""
+    text = (text or "").lower()
+    pattern, by_long_form = _long_forms(tuple(sorted((acronyms or {}).items())))
+    text = pattern.sub(lambda m: " %s " % by_long_form[re.sub(r"[\s-]+", " ", m.group(1))], text)
+    return _WORD.findall(text)
+
+
+def _singular(term):
+    # Crude, but applied to both sides it makes "KPIs" match "KPI"
+    return " ".join(w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in term.split())
+
+
+def terms(text, acronyms=None):
+    """The set of unigram and bigram terms in `text`, singularized for membership tests."""
+    tokens = [_singular(t) for t in tokenize(text, acronyms)]
+    found = set(tokens)
+    found.update(" ".join(pair) for pair in zip(tokens, tokens[1:]))
+    return found
+
+
+def job_keywords(job_text, acronyms=None):
+    """Keywords worth checking for, most important first.
+
+    Unigrams are kept unless they are stopwords or numbers. Bigrams are kept
+    when they repeat or are written as a capitalized name ("Power BI",
+    "Google Analytics"), which filters out incidental word pairs.
+    """
+    clauses = [tokenize(clause, acronyms) for clause in _CLAUSE_BREAK.split(job_text or "")]
+    tokens = [t for clause in clauses for t in clause]
+    counts = Counter(t for t in tokens if t not in STOPWORDS and len(t) > 1 and _HAS_LETTER.search(t))
+    bigrams = Counter(
+        " ".join(pair) for clause in clauses for pair in zip(clause, clause[1:])
+        if pair[0] not in STOPWORDS and pair[1] not in STOPWORDS
+    )
+    named = {" ".join(tokenize(" ".join(pair), acronyms)) for pair in _CAPITALIZED_PAIR.findall(job_text or "")}
+    for bigram, count in bigrams.items():
+        if count > 1 or bigram in named:
+            counts[bigram] = count + 1
+            # Don't also ask for the words of a phrase on their own
+            for word in bigram.split():
+                counts.pop(word, None)
+    return [term for term, _ in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+
+
+def analyze(cv_text, job_description, minimum_qualification=""):
+    started = time.perf_counter()
+    acronyms = defined_acronyms(cv_text, job_description, minimum_qualification)
+    # Minimum-qualification terms come first: missing one of those matters most
+    wanted = job_keywords(minimum_qualification, acronyms)
+    seen = set(wanted)
+    wanted += [t for t in job_keywords(job_description, acronyms) if t not in seen]
+    present = terms(cv_text, acronyms)
+    matched = [t for t in wanted if _singular(t) in present]
+    missing = [t for t in wanted if _singular(t) not in present]
+    coverage = len(matched) / len(wanted) if wanted else 1.0
+    return CoverageReport(coverage, matched, missing, (time.perf_counter() - started) * 1000)
+
+
+def display_term(term, acronyms=None):
+    acronyms = dict(ACRONYMS, **(acronyms or {}))
+    if term in acronyms:
+        return "%s (%s)" % (acronyms[term], term.upper())
+    return term
+
+
+def format_gaps(report, limit=40):
+    """The missing terms as a bullet list for the tailoring prompt."""
+    if not report.missing:
+        return "- None: the CV already covers the job description keywords."
+    lines = ["- %s" % display_term(term) for term in report.missing[:limit]]
+    if len(report.missing) > limit:
+        lines.append("- ... and %d less frequent terms" % (len(report.missing) - limit))
+    return "\n".join(lines)
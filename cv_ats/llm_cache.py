@@ -0,0 +1,142 @@
+"""Persistent cache for model responses.
+
+Responses are stored in SQLite under LLM_CACHE_DIR (default `.cache`) and
+keyed by model name, prompt template version and the normalized input text,
+so pressing "Improve CV" twice, or tailoring one CV to several jobs, reuses
+the same general pass. Entries expire after LLM_CACHE_TTL seconds and the
+oldest are evicted beyond LLM_CACHE_MAX_ENTRIES. Set LLM_CACHE_BYPASS=1 to
+always call the model.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from .metrics import inc
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return _WHITESPACE.sub(" ", text or "").strip()
+
+
+def make_key(model_name, template_version, *inputs):
+    h = hashlib.sha256()
+    for part in (model_name, template_version) + tuple(normalize_text(i) for i in inputs):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=5000, bypass=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " template_version TEXT NOT NULL,"
+                " response TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation keeps this safe to share
+        # between Streamlit sessions, which run on different threads.
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        if self.bypass:
+            return None
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        inc("cv_cache_requests_total", cache="llm", result="miss" if row is None else "hit")
+        return None if row is None else row[0]
+
+    def put(self, key, model_name, template_version, response):
+        if self.bypass:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, template_version, response, now, now),
+            )
+            self._evict(conn, now)
+
+    def get_or_generate(self, model_name, template_version, inputs, generate_fn, valid=None):
+        """Return the cached response for `inputs`, calling `generate_fn()` on a miss.
+
+        A generated response failing `valid(response)` is returned but not stored.
+        """
+        key = make_key(model_name, template_version, *inputs)
+        response = self.get(key)
+        if response is None:
+            response = generate_fn()
+            if valid is None or valid(response):
+                self.put(key, model_name, template_version, response)
+        return response
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache(
+    os.path.join(os.getenv("LLM_CACHE_DIR", ".cache"), "responses.sqlite3"),
+    ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000")),
+    bypass=os.getenv("LLM_CACHE_BYPASS", "").lower() in ("1", "true", "yes"),
+)
@@ -0,0 +1,360 @@
+"""In-process metrics for the CV pipeline.
+
+Each stage (PDF read, extraction, prompt build, model call, render) is timed
+into a latency histogram with `with stage("extract"):`, and counters track
+cache hits and misses, errors and model tokens in and out. Histograms also
+cover PDF sizes in bytes and pages.
+
+- `prometheus_text()` renders everything in the Prometheus text format; with
+  METRICS_PORT set it is served over HTTP at /metrics (and JSON at
+  /metrics.json).
+- Work done inside `with request("general"):` is also collected per request.
+  With METRICS_JSON_LOG set to a file path ("-" for stderr), one JSON line is
+  written per request, with its stage times and counters.
+- `request(kind, profile="cprofile")` or `profile="tracemalloc"` profiles that
+  single request and keeps the report on the returned record. tracemalloc
+  traces the whole process, so concurrent requests show up in its report too.
+
+Metrics are per process; batch.py's extraction workers keep their own.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+PAGE_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+BYTE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+RSS_BUCKETS = tuple(2 ** 20 * 2 ** i for i in range(5, 14))
+
+# name -> (type, help, histogram buckets)
+DEFINITIONS = {
+    "cv_stage_seconds": ("histogram", "Time spent in each pipeline stage.", LATENCY_BUCKETS),
+    "cv_stage_errors_total": ("counter", "Pipeline stages that raised.", None),
+    "cv_request_seconds": ("histogram", "End-to-end time of each request.", LATENCY_BUCKETS),
+    "cv_requests_total": ("counter", "Requests by kind and outcome.", None),
+    "cv_model_call_seconds": ("histogram", "Time of each upstream model call, streams until the last chunk.",
+                              LATENCY_BUCKETS),
+    "cv_model_calls_total": ("counter", "Upstream model calls by outcome.", None),
+    "cv_model_prompt_tokens_total": ("counter", "Prompt tokens reported by the model.", None),
+    "cv_model_output_tokens_total": ("counter", "Output tokens reported by the model.", None),
+    "cv_model_retries_total": ("counter", "Model calls retried by the scheduler.", None),
+    "cv_route_decisions_total": ("counter", "Model routing decisions by step, model and reason.", None),
+    "cv_scheduler_wait_seconds": ("histogram", "Time calls waited for a slot or for quota.", LATENCY_BUCKETS),
+    "cv_cache_requests_total": ("counter", "Cache lookups by cache and result.", None),
+    "cv_prompt_tokens": ("histogram", "Estimated tokens of each rendered prompt.", TOKEN_BUCKETS),
+    "cv_pdf_bytes": ("histogram", "Size of each uploaded PDF.", BYTE_BUCKETS),
+    "cv_pdf_pages": ("histogram", "Pages of each parsed PDF.", PAGE_BUCKETS),
+    "cv_edits_applied_total": ("counter", "Model edit operations applied to a CV.", None),
+    "cv_edits_skipped_total": ("counter", "Model edit operations whose text could not be found.", None),
+    "cv_edit_fallbacks_total": ("counter", "Edit lists rejected in favour of a full rewrite, by reason.", None),
+    "cv_pdf_rejected_total": ("counter", "PDFs refused by the ingestion limits, by reason.", None),
+    "cv_pdf_truncated_total": ("counter", "PDFs whose text was cut off at PDF_MAX_CHARS.", None),
+    "cv_pdf_peak_rss_bytes": ("histogram", "Peak resident memory of a process while it parsed a PDF.", RSS_BUCKETS),
+}
+
+
+class Registry:
+    def __init__(self, definitions=DEFINITIONS):
+        self.definitions = definitions
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self.definitions[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+    def prometheus_text(self):
+        by_name = defaultdict(list)
+        for (name, labels), value in sorted(self.snapshot().items()):
+            by_name[name].append((labels, value))
+        lines = []
+        for name, series in by_name.items():
+            kind, help_text, buckets = self.definitions[name]
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in series:
+                if kind == "counter":
+                    lines.append("%s%s %s" % (name, _labels(labels), _number(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ("+Inf",), value[:-1]):
+                    cumulative += count
+                    lines.append("%s_bucket%s %d" % (name, _labels(labels + (("le", _number(bound)),)), cumulative))
+                lines.append("%s_sum%s %s" % (name, _labels(labels), _number(value[-1])))
+                lines.append("%s_count%s %d" % (name, _labels(labels), cumulative))
+        return "\n".join(lines) + "\n"
+
+    def as_json(self):
+        values = []
+        for (name, labels), value in sorted(self.snapshot().items()):
+            entry = {"name": name, "labels": dict(labels)}
+            if isinstance(value, list):
+                entry.update(count=sum(value[:-1]), sum=value[-1])
+            else:
+                entry["value"] = value
+            values.append(entry)
+        return values
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+
+
+def _number(value):
+    return value if isinstance(value, str) else ("%d" % value if value == int(value) else repr(float(value)))
+
+
+registry = Registry()
+
+
+class RequestRecord:
+    def __init__(self, kind):
+        self.kind = kind
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.status = "ok"
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.profile_report = None
+        self._lock = threading.Lock()
+
+    def add(self, bucket, key, value):
+        with self._lock:
+            bucket[key] += value
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "request": self.kind,
+                "started_at": self.started_at,
+                "duration_ms": round(self.duration_ms, 2),
+                "status": self.status,
+                "stages_ms": {name: round(ms, 2) for name, ms in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+
+_current = ContextVar("metrics_request", default=None)
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+    record = _current.get()
+    if record is not None:
+        short = name[3:] if name.startswith("cv_") else name
+        short = short[:-6] if short.endswith("_total") else short
+        if labels:
+            short += "{%s}" % ",".join(str(v) for _, v in sorted(labels.items()))
+        record.add(record.counters, short, value)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def add_stage_time(name, seconds):
+    record = _current.get()
+    if record is not None:
+        record.add(record.stages, name, seconds * 1000)
+
+
+@contextmanager
+def stage(name):
+    """Time the block as pipeline stage `name`, counting it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("cv_stage_errors_total", stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe("cv_stage_seconds", elapsed, stage=name)
+        add_stage_time(name, elapsed)
+
+
+def record_model_call(model_name, seconds, usage=None, error=None):
+    """Called by the metered backend for every upstream call, with the response's usage_metadata."""
+    observe("cv_model_call_seconds", seconds, model=model_name)
+    add_stage_time("model", seconds)
+    inc("cv_model_calls_total", model=model_name, status="ok" if error is None else type(error).__name__)
+    if usage is not None:
+        inc("cv_model_prompt_tokens_total", getattr(usage, "prompt_token_count", 0) or 0, model=model_name)
+        inc("cv_model_output_tokens_total", getattr(usage, "candidates_token_count", 0) or 0, model=model_name)
+
+
+def _start_profile(mode):
+    if mode == "cprofile":
+        # The profilers and the HTTP server are imported on first use; most processes never need them
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if mode == "tracemalloc":
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        return started_here
+    if mode:
+        raise ValueError("Unknown profile mode %r, expected 'cprofile' or 'tracemalloc'" % mode)
+    return None
+
+
+def _stop_profile(mode, state):
+    import io
+    import pstats
+
+    out = io.StringIO()
+    if mode == "cprofile":
+        state.disable()
+        pstats.Stats(state, stream=out).sort_stats("cumulative").print_stats(30)
+    elif mode == "tracemalloc":
+        current, peak = tracemalloc.get_traced_memory()
+        out.write("Traced memory: %.1f MiB now, %.1f MiB peak\n\n" % (current / 2 ** 20, peak / 2 ** 20))
+        for stat in tracemalloc.take_snapshot().statistics("lineno")[:20]:
+            out.write("%s\n" % stat)
+        if state:
+            tracemalloc.stop()
+    return out.getvalue()
+
+
+@contextmanager
+def request(kind, profile=None):
+    """Collect the metrics of one request (optionally profiling it) and log them as a JSON line."""
+    record = RequestRecord(kind)
+    token = _current.set(record)
+    profiler = _start_profile(profile)
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        record.status = "error"
+        raise
+    finally:
+        if profile:
+            record.profile_report = _stop_profile(profile, profiler)
+        _current.reset(token)
+        elapsed = time.perf_counter() - started
+        record.duration_ms = elapsed * 1000
+        observe("cv_request_seconds", elapsed, kind=kind)
+        registry.inc("cv_requests_total", kind=kind, status=record.status)
+        _log_request(record)
+
+
+_log_lock = threading.Lock()
+
+
+def _log_request(record):
+    path = os.getenv("METRICS_JSON_LOG")
+    if not path:
+        return
+    line = json.dumps(record.as_dict()) + "\n"
+    with _log_lock:
+        if path == "-":
+            sys.stderr.write(line)
+        else:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+def prometheus_text():
+    return registry.prometheus_text()
+
+
+def model_totals():
+    """Calls, seconds and tokens per model, from the cv_model_* metrics."""
+    totals = defaultdict(lambda: defaultdict(float))
+    for (name, labels), value in registry.snapshot().items():
+        model = dict(labels).get("model")
+        if model is None:
+            continue
+        if name == "cv_model_call_seconds":
+            totals[model]["calls"] += sum(value[:-1])
+            totals[model]["seconds"] += value[-1]
+        elif name == "cv_model_prompt_tokens_total":
+            totals[model]["prompt_tokens"] += value
+        elif name == "cv_model_output_tokens_total":
+            totals[model]["output_tokens"] += value
+    return {model: dict(values) for model, values in totals.items()}
+
+
+def _handler_class():
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = prometheus_text(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.as_json()), "application/json"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return MetricsHandler
+
+
+_server = None
+
+
+def serve(port, host="0.0.0.0"):
+    """Serve /metrics and /metrics.json from a daemon thread; a second call is a no-op."""
+    from http.server import ThreadingHTTPServer
+
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((host, port), _handler_class())
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
+
+
+if os.getenv("METRICS_PORT") and multiprocessing.parent_process() is None:
+    try:
+        serve(int(os.getenv("METRICS_PORT")))
+    except OSError as exc:
+        logger.warning("metrics endpoint not started on port %s: %s", os.getenv("METRICS_PORT"), exc)
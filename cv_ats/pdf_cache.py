@@ -0,0 +1,168 @@
+"""Content-addressed cache for text extracted from uploaded PDFs.
+
+Streamlit reruns the whole script on every widget interaction, so the apps
+would otherwise re-parse the same upload each time. Results are keyed by a
+SHA-256 of the PDF bytes and kept in an in-process LRU, with an optional
+on-disk layer (enabled by setting PDF_CACHE_DIR) that evicts the least
+recently used files once PDF_CACHE_MAX_BYTES is exceeded.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from .metrics import inc
+from .pdf_extract import MAX_BYTES, check_size
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_upload(pdf_file):
+    """The upload's bytes, refused with PdfRejected when over PDF_MAX_BYTES."""
+    # UploadedFile is a BytesIO: getvalue() hands back the buffer it was created from without
+    # copying (getbuffer() would copy it) and does not depend on the read position
+    if hasattr(pdf_file, "getvalue"):
+        data = pdf_file.getvalue()
+    else:
+        # Files are read at most one byte past the limit
+        data = pdf_file.read(MAX_BYTES + 1 if MAX_BYTES else -1)
+    check_size(len(data))
+    return data
+
+
+class PdfTextCache:
+    def __init__(self, max_entries=64, disk_dir=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                inc("cv_cache_requests_total", cache="pdf", result="hit")
+                return self._entries[key]
+
+        text = self._disk_get(key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                inc("cv_cache_requests_total", cache="pdf", result="miss")
+                return None
+            self.disk_hits += 1
+            self._remember(key, text)
+        inc("cv_cache_requests_total", cache="pdf", result="disk_hit")
+        return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._remember(key, text)
+        self._disk_put(key, text)
+
+    def get_or_extract(self, data, extract_fn, namespace=None):
+        """Return the cached text for `data`, calling `extract_fn(data)` on a miss.
+
+        `namespace` keeps other derived forms of the same PDF (e.g. its sections) apart from its plain text.
+        """
+        key = hash_bytes(data) if namespace is None else "%s-%s" % (namespace, hash_bytes(data))
+        text = self.get(key)
+        if text is None:
+            text = extract_fn(data)
+            self.put(key, text)
+        return text
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+    def _remember(self, key, text):
+        self._entries[key] = text
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".txt")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            return None
+        # Touch the file so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return text
+
+    def _disk_put(self, key, text):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith(".txt"):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+# Module-level instance: imported modules survive Streamlit reruns, the app
+# script's own globals do not.
+pdf_text_cache = PdfTextCache(
+    max_entries=int(os.getenv("PDF_CACHE_MAX_ENTRIES", "64")),
+    disk_dir=os.getenv("PDF_CACHE_DIR") or None,
+    max_disk_bytes=int(os.getenv("PDF_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+)
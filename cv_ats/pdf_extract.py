@@ -0,0 +1,301 @@
+"""Page-chunked PDF text extraction with size limits.
+
+Small documents are extracted serially. From PARALLEL_PAGE_THRESHOLD pages
+upwards the pages are split into contiguous chunks and parsed in a shared
+process pool; the PDF is copied once into shared memory rather than pickled
+for every chunk. `iter_page_text` yields page text in order as it becomes
+available so later stages can start before the whole document is parsed.
+
+Every document goes through `open_document`, which closes it on exit and
+rejects, before any page is parsed, uploads over PDF_MAX_BYTES, documents
+over PDF_MAX_PAGES and documents without a text layer (scanned CVs: no page
+references a font). Extraction stops once PDF_MAX_CHARS characters have
+been produced. A limit of 0 disables it.
+
+`extract_document` also reports the peak RSS of the process (and of the
+pool workers) while the document was parsed, as the cv_pdf_peak_rss_bytes
+metric; `python -m cv_ats.pdf_extract FILE...` prints it per document.
+The peak can only be reset for the whole process, so it is sampled: a
+document is measured only when no other extract_document call is running
+in the process (the Streamlit server parses uploads on several threads),
+and its peak_rss is None otherwise. Extraction never waits for a
+measurement. Documents read through `iter_page_text` directly are not
+measured.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from .metrics import inc, observe
+
+PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", "16"))
+PAGES_PER_CHUNK = int(os.getenv("PDF_PAGES_PER_CHUNK", "8"))
+MAX_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or None
+MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(10 * 1024 * 1024)))
+# Well above the 30-80 page portfolios the parallel path is for
+MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "150"))
+MAX_CHARS = int(os.getenv("PDF_MAX_CHARS", "200000"))
+
+logger = logging.getLogger(__name__)
+
+Extraction = namedtuple("Extraction", "text pages truncated peak_rss")
+
+_pool = None
+_pool_lock = threading.Lock()
+# extract_document calls in flight, and whether one is being measured and another overlapped it
+_extractions = {"active": 0, "measuring": False, "overlapped": False}
+_extractions_lock = threading.Lock()
+
+
+class PdfRejected(ValueError):
+    """The PDF is over a limit or has no text to extract; the message can be shown to the user."""
+
+    def __init__(self, reason, message):
+        # Both go to the base class so the exception pickles, e.g. out of cv_ats.batch's extraction pool
+        super().__init__(reason, message)
+        self.reason = reason
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def check_size(size, max_bytes=None):
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    if max_bytes and size > max_bytes:
+        inc("cv_pdf_rejected_total", reason="bytes")
+        raise PdfRejected("bytes", "The PDF is larger than %.1f MB." % (max_bytes / 1e6))
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the Streamlit server process is multi-threaded
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def _open(data):
+    import fitz
+
+    return fitz.open(stream=data, filetype="pdf")
+
+
+def _has_text_layer(doc):
+    # Reads each page's resource dictionary only; image-only pages reference no fonts
+    return any(doc.get_page_fonts(i) for i in range(doc.page_count))
+
+
+@contextmanager
+def open_document(data, max_pages=None):
+    """Open `data` after checking the byte, page and text-layer limits, and close it on exit."""
+    check_size(len(data))
+    max_pages = MAX_PAGES if max_pages is None else max_pages
+    try:
+        doc = _open(data)
+    except Exception as exc:
+        inc("cv_pdf_rejected_total", reason="invalid")
+        raise PdfRejected("invalid", "The file could not be read as a PDF.") from exc
+    try:
+        if max_pages and doc.page_count > max_pages:
+            inc("cv_pdf_rejected_total", reason="pages")
+            raise PdfRejected("pages", "The PDF has %d pages; at most %d are accepted." % (doc.page_count, max_pages))
+        if not _has_text_layer(doc):
+            inc("cv_pdf_rejected_total", reason="image_only")
+            raise PdfRejected("image_only", "The PDF has no text layer (is it a scan?); please upload a text PDF.")
+        yield doc
+    finally:
+        doc.close()
+
+
+def read_peak_rss():
+    """Peak resident set size of this process in bytes, or None where it can't be read."""
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def reset_peak_rss():
+    # Linux only: lowers VmHWM to the current RSS. Elsewhere the peak covers the whole process lifetime.
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _extract_range(name, size, start, stop):
+    # Runs in a worker process; each worker opens its own copy of the document from shared memory
+    from multiprocessing import shared_memory
+
+    reset_peak_rss()
+    # Pool workers share the parent's resource tracker, so attaching doesn't take over the cleanup
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        view = shm.buf[:size]
+        try:
+            doc = _open(view)
+            try:
+                texts = [doc[i].get_text() for i in range(start, stop)]
+            finally:
+                doc.close()
+        finally:
+            view.release()
+    finally:
+        shm.close()
+    return texts, read_peak_rss()
+
+
+def _iter_parallel(data, pages, chunk_size, worker_peaks):
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    futures = []
+    try:
+        shm.buf[:len(data)] = data
+        pool = _get_pool()
+        futures = [
+            pool.submit(_extract_range, shm.name, len(data), start, min(start + chunk_size, pages))
+            for start in range(0, pages, chunk_size)
+        ]
+        for future in futures:
+            texts, peak = future.result()
+            if peak is not None:
+                worker_peaks.append(peak)
+            for text in texts:
+                yield text
+    finally:
+        # The consumer may stop early; don't leave queued chunks running
+        for future in futures:
+            future.cancel()
+        for future in futures:
+            if not future.cancelled():
+                # A running chunk still has the segment mapped
+                future.exception()
+        shm.close()
+        shm.unlink()
+
+
+def _iter_pages(data, parallel, chunk_size, stats):
+    with open_document(data) as doc:
+        pages = doc.page_count
+        observe("cv_pdf_pages", pages)
+        if parallel is None:
+            parallel = pages >= PARALLEL_PAGE_THRESHOLD and multiprocessing.parent_process() is None
+        if not parallel or pages <= chunk_size:
+            for page in doc:
+                yield page.get_text()
+            return
+    yield from _iter_parallel(data, pages, chunk_size, stats["worker_peaks"])
+
+
+def iter_page_text(data, parallel=None, chunk_size=PAGES_PER_CHUNK, max_chars=None, stats=None):
+    """Yield the text of each page in order, stopping once `max_chars` characters have been yielded.
+
+    `parallel=None` picks the process pool only for documents of at least
+    PARALLEL_PAGE_THRESHOLD pages, where it outweighs the cost of shipping
+    the bytes to the workers, and never from inside a worker process (e.g.
+    cv_ats.batch's extraction pool). Raises PdfRejected before yielding
+    anything if the document is over a limit. `stats`, if given, is a dict
+    that gets "truncated" and the pool workers' "worker_peaks" RSS.
+    """
+    max_chars = MAX_CHARS if max_chars is None else max_chars
+    stats = {} if stats is None else stats
+    stats.update(truncated=False, worker_peaks=[])
+    pages = _iter_pages(data, parallel, chunk_size, stats)
+    remaining = max_chars
+    try:
+        for text in pages:
+            if max_chars and len(text) > remaining:
+                stats["truncated"] = True
+                inc("cv_pdf_truncated_total")
+                yield text[:remaining]
+                return
+            remaining -= len(text)
+            yield text
+    finally:
+        # Closes the document (or cancels the remaining chunks) now rather than when garbage collected
+        pages.close()
+
+
+def extract_document(data, parallel=None, max_chars=None):
+    stats = {}
+    with _extractions_lock:
+        _extractions["active"] += 1
+        measuring = _extractions["active"] == 1
+        if measuring:
+            _extractions.update(measuring=True, overlapped=False)
+        elif _extractions["measuring"]:
+            _extractions["overlapped"] = True
+    try:
+        if measuring:
+            reset_peak_rss()
+        texts = list(iter_page_text(data, parallel=parallel, max_chars=max_chars, stats=stats))
+        peak = max([p for p in [read_peak_rss()] + stats["worker_peaks"] if p is not None], default=None)
+    finally:
+        with _extractions_lock:
+            _extractions["active"] -= 1
+            if measuring:
+                # Another document's pages were in memory too; this reading isn't one document's
+                measuring = not _extractions["overlapped"]
+                _extractions["measuring"] = False
+    if not measuring:
+        peak = None
+    text = "".join(texts)
+    if peak is not None:
+        observe("cv_pdf_peak_rss_bytes", peak)
+    logger.debug("extracted %d pages, %d chars, peak RSS %s", len(texts), len(text), peak)
+    return Extraction(text, len(texts), stats["truncated"], peak)
+
+
+def extract_text(data, parallel=None):
+    return extract_document(data, parallel=parallel).text
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extract PDFs and report pages, characters and peak RSS.")
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--serial", action="store_true", help="Never use the process pool")
+    args = parser.parse_args(argv)
+    print("%-40s %6s %9s %9s %s" % ("pdf", "pages", "chars", "rss MiB", "status"))
+    failures = 0
+    for path in args.pdfs:
+        try:
+            with open(path, "rb") as f:
+                data = f.read(MAX_BYTES + 1 if MAX_BYTES else -1)
+            result = extract_document(data, parallel=False if args.serial else None)
+        except PdfRejected as exc:
+            failures += 1
+            print("%-40s %6s %9s %9s rejected (%s): %s" % (path, "-", "-", "-", exc.reason, exc))
+            continue
+        print("%-40s %6d %9d %9s %s" % (
+            path, result.pages, len(result.text),
+            "%.1f" % (result.peak_rss / 2 ** 20) if result.peak_rss is not None else "-",
+            "truncated" if result.truncated else "ok",
+        ))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
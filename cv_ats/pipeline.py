@@ -0,0 +1,380 @@
+"""The CV enhancement pipeline for one prompt profile.
+
+`get_pipeline(profile)` builds a Pipeline once per process: the prompt
+templates are compiled and the model client is created on first use, so
+Streamlit reruns of an app script, and every batch or benchmark run, reuse
+them. Heavy dependencies (the Gemini client, PyMuPDF, NumPy) are only
+imported by the code paths that need them. With a Router (MODEL_ROUTING=1,
+see routing.py) each step picks its model instead of using the profile's.
+"""
+
+from contextlib import closing
+from functools import lru_cache
+
+from .backends import get_backend
+from .edits import DEFAULT_OUTPUT, OUTPUT_MODES, improve_with_edits
+from .jobs import job_key
+from .keywords import analyze, format_gaps
+from .llm_cache import make_key, response_cache
+from .metrics import observe, stage
+from .pdf_cache import pdf_text_cache, read_upload
+from .pdf_extract import extract_text
+from .profiles import SPECIFIC_PROMPT, get_profile
+from .prompt_templates import compile_template
+from .routing import default_router
+from .sections import SECTION_PROMPT_VERSION, cached_sections, enhance_changed_sections
+from .specific_modes import (
+    FUSED_SUFFIX, check_mode, fan_out, run_fused, run_fused_stream, start_job_analysis, tailor_from_analysis,
+    tailor_from_analysis_stream,
+)
+from .streaming import RESTART, cached_stream, stream_text
+
+# Cache version suffix recording that a request's fast answer was escalated, and to which model
+ESCALATED_SUFFIX = "-escalated"
+
+
+class Pipeline:
+    def __init__(self, profile, model=None, router=None):
+        self.profile = profile
+        self.model_name = profile.model_name
+        self.router = router
+        # Model name -> backend; the router may use several
+        self.backends = {}
+        if model is not None:
+            self.backends[self.model_name] = model
+        # Bump these whenever the prompt text changes so stale cached responses are not reused
+        self.general_version = "%s-general-v1" % profile.key
+        self.specific_version = "%s-specific-v2" % profile.key
+        self.fused_version = "%s-fused-v2" % profile.key
+        self.general_template = compile_template(
+            "%s-general" % profile.key, self.general_version, profile.general_prompt
+        )
+        self.fused_template = compile_template(
+            "%s-fused" % profile.key, self.fused_version, profile.general_prompt + FUSED_SUFFIX,
+            weights={"cv_text": 6, "keyword_gaps": 3, "minimum_qualification": 1},
+        )
+        self.specific_template = compile_template(
+            "%s-specific" % profile.key, self.specific_version, SPECIFIC_PROMPT,
+            # When the inputs overflow the budget the CV keeps the largest share
+            weights={"improved_cv": 6, "keyword_gaps": 3, "minimum_qualification": 1},
+        )
+
+    @property
+    def model(self):
+        return self.backend_for(self.model_name)
+
+    @model.setter
+    def model(self, backend):
+        self.backends[self.model_name] = backend
+
+    def backend_for(self, model_name):
+        # Created on first use: importing and configuring the Gemini client is the slowest part of startup
+        backend = self.backends.get(model_name)
+        if backend is None:
+            backend = self.backends.setdefault(model_name, get_backend(model_name))
+        return backend
+
+    def route(self, step, text, coverage=None):
+        """The (backend, model name) for a step: the profile's model, or the router's pick for this input."""
+        if self.router is None:
+            return self.model, self.model_name
+        model_name = self.router.choose(step, text, coverage)
+        return self.backend_for(model_name), model_name
+
+    def coverage(self, cv_text, job_description, minimum_qualification):
+        # Only the router needs it up front
+        if self.router is None:
+            return None
+        return analyze(cv_text, job_description, minimum_qualification).coverage
+
+    def generate(self, step, version, inputs, build_prompt, text, coverage=None):
+        """A cached, routed call; output of the fast model that fails validation is redone on the pro model."""
+        model, model_name = self.route(step, text, coverage)
+        if self.router is not None and model_name != self.router.pro_model:
+            escalated = self.escalated(model_name, version, inputs)
+            if escalated is None:
+                valid = lambda output: self.router.valid(output, text)
+                # An answer that fails validation isn't cached, or every repeat would read it back and escalate again
+                output = response_cache.get_or_generate(
+                    model_name, version, inputs, lambda: model.generate_content(build_prompt()).text, valid
+                )
+                if valid(output):
+                    return output
+                escalated = self.escalate(step, model_name, version, inputs)
+            model, model_name = self.backend_for(escalated), escalated
+        return response_cache.get_or_generate(
+            model_name, version, inputs, lambda: model.generate_content(build_prompt()).text
+        )
+
+    def generate_stream(self, step, version, inputs, build_prompt, text, coverage=None, timings=None):
+        """Streaming counterpart of generate.
+
+        The fast model's output can only be judged once it has streamed; if it
+        fails validation it isn't cached, RESTART is yielded and the pro
+        model's answer streams in its place.
+        """
+        model, model_name = self.route(step, text, coverage)
+
+        def open_stream(model, model_name, valid=None):
+            return cached_stream(
+                response_cache, model_name, version, inputs, lambda: stream_text(model, build_prompt(), timings), valid
+            )
+
+        if self.router is not None and model_name != self.router.pro_model:
+            escalated = self.escalated(model_name, version, inputs)
+            if escalated is None:
+                valid = lambda output: self.router.valid(output, text)
+                parts = []
+                with closing(open_stream(model, model_name, valid)) as chunks:
+                    for chunk in chunks:
+                        parts.append(chunk)
+                        yield chunk
+                if valid("".join(parts)):
+                    return
+                escalated = self.escalate(step, model_name, version, inputs)
+                yield RESTART
+            model, model_name = self.backend_for(escalated), escalated
+        yield from open_stream(model, model_name)
+
+    def escalated(self, model_name, version, inputs):
+        """The model a request's fast answer was escalated to before, if it was."""
+        return response_cache.get(make_key(model_name, version + ESCALATED_SUFFIX, *inputs))
+
+    def escalate(self, step, model_name, version, inputs):
+        # Recorded apart from the answers, which stay keyed by the model that wrote them,
+        # so a repeat goes straight to the pro answer without another validation escalation
+        escalated = self.router.escalate(step)
+        response_cache.put(
+            make_key(model_name, version + ESCALATED_SUFFIX, *inputs), model_name, version + ESCALATED_SUFFIX, escalated
+        )
+        return escalated
+
+    def extract_text_from_pdf(self, pdf_file):
+        with stage("pdf_read"):
+            data = read_upload(pdf_file)
+        observe("cv_pdf_bytes", len(data))
+        # Reruns and repeat uploads only pay for hashing the bytes; long documents are parsed in parallel
+        with stage("extract"):
+            return pdf_text_cache.get_or_extract(data, extract_text)
+
+    def extract_sections_from_pdf(self, pdf_file):
+        # Headings are found from the PDF's font sizes and weights, so this needs the original file
+        return cached_sections(pdf_text_cache, read_upload(pdf_file))
+
+    def build_general_prompt(self, cv_text):
+        return self.general_template.render(cv_text=cv_text)
+
+    def improve_cv_general(self, cv_text, output=None):
+        output = output or DEFAULT_OUTPUT
+        if output == "edits":
+            return self.improve_cv_edits(cv_text).text
+        if output != "full":
+            raise ValueError("Unknown output mode %r, expected one of %s" % (output, ", ".join(OUTPUT_MODES)))
+        return self.generate(
+            "general", self.general_version, (cv_text,), lambda: self.build_general_prompt(cv_text).text, cv_text
+        )
+
+    def improve_cv_edits(self, cv_text):
+        # The model returns targeted edits that are applied here; unusable edit lists fall back to the full rewrite
+        model, model_name = self.route("edits", cv_text)
+        return improve_with_edits(
+            model, model_name, cv_text, lambda: self.improve_cv_general(cv_text, "full"),
+            self.profile.metrics_instruction,
+        )
+
+    def improve_cv_general_stream(self, cv_text, timings=None):
+        # Yields chunks as they arrive; a cached response is replayed in one piece
+        return self.generate_stream(
+            "general", self.general_version, (cv_text,), lambda: self.build_general_prompt(cv_text).text, cv_text,
+            timings=timings,
+        )
+
+    def improve_cv_sections(self, sections):
+        # Only sections whose content has no cached rewrite are sent to the model
+        model, model_name = self.route("sections", "\n\n".join(section.text for section in sections))
+        return enhance_changed_sections(model, model_name, sections, self.profile.metrics_instruction)
+
+    def build_specific_prompt(self, improved_cv, job_description, minimum_qualification):
+        # Only the keywords the improved CV still lacks are sent, not the whole job description
+        keyword_gaps = format_gaps(analyze(improved_cv, job_description, minimum_qualification))
+        return self.specific_template.render(
+            improved_cv=improved_cv, keyword_gaps=keyword_gaps, minimum_qualification=minimum_qualification
+        )
+
+    def start_job_analysis(self, job_description, minimum_qualification):
+        # Overlapped mode: the job description is analysed in the background while the general pass runs
+        return start_job_analysis(
+            *self.route("job_analysis", job_description), job_description, minimum_qualification
+        )
+
+    def tailor(self, cv_text, improved_cv, job_description, minimum_qualification, mode, job_analysis=None):
+        """The job-specific step alone, given the general pass (unused when fused) and the job analysis (overlapped)."""
+        if mode == "fused":
+            # A single call does the general and the job-specific rewrite together
+            model, model_name = self.route(
+                "tailoring", cv_text, self.coverage(cv_text, job_description, minimum_qualification)
+            )
+            return run_fused(model, model_name, self.fused_template, cv_text, job_description, minimum_qualification)
+        if mode == "overlapped":
+            model, model_name = self.route(
+                "tailoring", improved_cv, self.coverage(improved_cv, job_description, minimum_qualification)
+            )
+            return tailor_from_analysis(model, model_name, improved_cv, job_analysis, minimum_qualification)
+        return self.generate(
+            "tailoring", self.specific_version, (improved_cv, job_description, minimum_qualification),
+            lambda: self.build_specific_prompt(improved_cv, job_description, minimum_qualification).text,
+            improved_cv, self.coverage(improved_cv, job_description, minimum_qualification),
+        )
+
+    def tailor_stream(self, cv_text, improved_cv, job_description, minimum_qualification, mode, job_analysis=None,
+                      timings=None):
+        # Streaming counterpart of tailor
+        if mode == "fused":
+            model, model_name = self.route(
+                "tailoring", cv_text, self.coverage(cv_text, job_description, minimum_qualification)
+            )
+            return run_fused_stream(
+                model, model_name, self.fused_template, cv_text, job_description, minimum_qualification, timings
+            )
+        if mode == "overlapped":
+            model, model_name = self.route(
+                "tailoring", improved_cv, self.coverage(improved_cv, job_description, minimum_qualification)
+            )
+            return tailor_from_analysis_stream(
+                model, model_name, improved_cv, job_analysis, minimum_qualification, timings
+            )
+        return self.tailor_cv_stream(improved_cv, job_description, minimum_qualification, timings)
+
+    def improve_cv_specific(self, cv_text, job_description, minimum_qualification, mode=None):
+        mode = check_mode(mode)
+        analysis = self.start_job_analysis(job_description, minimum_qualification) if mode == "overlapped" else None
+        # First, improve the CV generally (served from the response cache when this CV was already improved)
+        improved_cv = None if mode == "fused" else self.improve_cv_general(cv_text)
+        # Then, tailor it for the specific job description
+        return self.tailor(
+            cv_text, improved_cv, job_description, minimum_qualification, mode,
+            analysis.result() if analysis is not None else None,
+        )
+
+    def improve_cv_specific_many(self, cv_text, targets, mode=None, max_workers=None):
+        """Tailor one CV for several (job_description, minimum_qualification) targets.
+
+        The general pass runs once (and, overlapped, every job analysis starts
+        alongside it); then at most `max_workers` (FANOUT_CONCURRENCY)
+        tailoring calls run at a time. Yields a Tailored per target as it
+        completes, with the exception instead of the output if it failed.
+        """
+        mode = check_mode(mode)
+        analyses = [self.start_job_analysis(*target) for target in targets] if mode == "overlapped" else None
+        improved_cv = None if mode == "fused" else self.improve_cv_general(cv_text)
+
+        def tailor(i):
+            job_analysis = analyses[i].result() if analyses is not None else None
+            return self.tailor(cv_text, improved_cv, *targets[i], mode=mode, job_analysis=job_analysis)
+
+        return fan_out(tailor, len(targets), max_workers)
+
+    def tailor_cv_stream(self, improved_cv, job_description, minimum_qualification, timings=None):
+        # Streaming counterpart of the tailoring step; the general pass is streamed separately
+        return self.generate_stream(
+            "tailoring", self.specific_version, (improved_cv, job_description, minimum_qualification),
+            lambda: self.build_specific_prompt(improved_cv, job_description, minimum_qualification).text,
+            improved_cv, self.coverage(improved_cv, job_description, minimum_qualification), timings,
+        )
+
+    # Background jobs (see jobs.py): ids name the request, run_* do the work
+
+    def general_job_id(self, cv_text, output=None):
+        return job_key(self.model_name, self.general_version, output or DEFAULT_OUTPUT, cv_text)
+
+    def sections_job_id(self, sections):
+        return job_key(
+            self.model_name, SECTION_PROMPT_VERSION, self.profile.metrics_instruction,
+            *(section.fingerprint for section in sections)
+        )
+
+    def specific_job_id(self, cv_text, job_description, minimum_qualification, mode):
+        return job_key(
+            self.model_name, self.specific_version, self.fused_version, mode,
+            cv_text, job_description, minimum_qualification,
+        )
+
+    def specific_many_job_id(self, cv_text, targets, mode):
+        return job_key(
+            self.model_name, self.specific_version, self.fused_version, mode, "many",
+            cv_text, *(text for target in targets for text in target),
+        )
+
+    def run_general_job(self, job, cv_text, stream=True, output=None):
+        if (output or DEFAULT_OUTPUT) == "edits":
+            # An edit list is only useful once complete, so this mode does not stream
+            result = self.improve_cv_edits(cv_text)
+            if result.fallback:
+                job.detail = "Edit list unusable (%s), fell back to a full rewrite" % result.fallback
+            else:
+                job.detail = "Applied %d edits (%d not found)" % (result.applied, result.skipped)
+            return result.text
+        if not stream:
+            return self.improve_cv_general(cv_text)
+        return job.stream("General enhancement", lambda timings: self.improve_cv_general_stream(cv_text, timings))
+
+    def run_sections_job(self, job, sections):
+        result = self.improve_cv_sections(sections)
+        job.detail = "Re-enhanced %d of %d sections" % (result.changed, result.changed + result.reused)
+        return result.text
+
+    def run_specific_job(self, job, cv_text, job_description, minimum_qualification, mode, stream=True):
+        if not stream:
+            return self.improve_cv_specific(cv_text, job_description, minimum_qualification, mode)
+        mode = check_mode(mode)
+        analysis = self.start_job_analysis(job_description, minimum_qualification) if mode == "overlapped" else None
+        improved_cv = None
+        if mode != "fused":
+            improved_cv = self.run_general_job(job, cv_text)
+        job_analysis = analysis.result() if analysis is not None else None
+        step = "Job-specific enhancement" if mode == "fused" else "Job-specific tailoring"
+        return job.stream(step, lambda timings: self.tailor_stream(
+            cv_text, improved_cv, job_description, minimum_qualification, mode, job_analysis, timings
+        ))
+
+    def run_specific_many_job(self, job, cv_text, targets, names, mode, stream=True, max_workers=None):
+        """Fan-out job: the general pass streams as the job's step, then each target streams into its part."""
+        mode = check_mode(mode)
+        analyses = [self.start_job_analysis(*target) for target in targets] if mode == "overlapped" else None
+        improved_cv = None if mode == "fused" else self.run_general_job(job, cv_text, stream)
+
+        def tailor(i):
+            job_analysis = analyses[i].result() if analyses is not None else None
+            if not stream:
+                job.check_cancelled()
+                text = self.tailor(cv_text, improved_cv, *targets[i], mode=mode, job_analysis=job_analysis)
+                job.set_part(names[i], text)
+                return text
+            return job.stream_part(names[i], lambda timings: self.tailor_stream(
+                cv_text, improved_cv, *targets[i], mode=mode, job_analysis=job_analysis, timings=timings
+            ))
+
+        failed = 0
+        for result in fan_out(tailor, len(targets), max_workers):
+            if result.error is not None:
+                # The other targets carry on; the page shows the error in this target's tab
+                job.set_part(names[result.index], error=result.error)
+                failed += 1
+        # A cancelled job's remaining targets fail fast; report the job as cancelled, not them
+        job.check_cancelled()
+        job.detail = "Tailored for %d of %d jobs" % (len(targets) - failed, len(targets))
+        return improved_cv
+
+
+@lru_cache(maxsize=None)
+def _get_pipeline(name):
+    # python-dotenv is only needed to fill in GOOGLE_API_KEY before the first client is created
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return Pipeline(get_profile(name), router=default_router())
+
+
+def get_pipeline(profile=None):
+    """The process-wide Pipeline for a profile name (or former app module name)."""
+    return _get_pipeline(get_profile(profile).name)
@@ -0,0 +1,175 @@
+"""Precompiled prompt templates with offline token budgeting.
+
+A template is compiled once per process: the static instruction text is
+split from the `{slot}` placeholders and its token count is computed up
+front. Rendering only has to fit the inputs into the remaining budget.
+Oversized inputs are trimmed deterministically (whitespace, repeated lines,
+then the middle of the text), so the same input always yields the same
+prompt and therefore the same response-cache key.
+"""
+
+import logging
+import os
+import re
+import string
+from collections import namedtuple
+from functools import lru_cache
+
+from .metrics import observe, stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PROMPT_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "32000"))
+
+# Words are counted in pieces of up to four characters and each punctuation
+# mark separately, which tracks subword tokenizers closely for CV text.
+_TOKEN_PIECE = re.compile(r"\w{1,4}|[^\w\s]")
+_SPACES = re.compile(r"[ \t\u00a0]+")
+_BLANK_RUNS = re.compile(r"\n{3,}")
+
+RenderedPrompt = namedtuple("RenderedPrompt", "text tokens static_tokens input_tokens truncated")
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return len(_TOKEN_PIECE.findall(text))
+
+
+def _tidy(text):
+    lines = [_SPACES.sub(" ", line).strip() for line in text.splitlines()]
+    return _BLANK_RUNS.sub("\n\n", "\n".join(lines)).strip()
+
+
+def _drop_repeated_lines(text):
+    # PDF extraction repeats page headers and footers on every page
+    seen = set()
+    kept = []
+    for line in text.split("\n"):
+        if line and line in seen and len(line) < 120:
+            continue
+        seen.add(line)
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def _cut_to_tokens(text, max_tokens, from_end=False):
+    pieces = list(_TOKEN_PIECE.finditer(text))
+    if len(pieces) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    if from_end:
+        return text[pieces[-max_tokens].start():]
+    return text[:pieces[max_tokens - 1].end()]
+
+
+def fit_text(text, max_tokens, head_share=0.8):
+    """Trim `text` to at most about `max_tokens` tokens, keeping its start and end."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    text = _tidy(text)
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    text = _drop_repeated_lines(text)
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    lines = text.split("\n")
+    marker_tokens = 12
+    head_budget = int((max_tokens - marker_tokens) * head_share)
+    tail_budget = max_tokens - marker_tokens - head_budget
+    head, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > head_budget:
+            break
+        head.append(line)
+        used += cost
+    tail, used = [], 0
+    for line in reversed(lines[len(head):]):
+        cost = estimate_tokens(line) + 1
+        if used + cost > tail_budget:
+            break
+        tail.append(line)
+        used += cost
+    tail.reverse()
+    if not head and not tail:
+        # A single enormous line: cut by token pieces instead
+        return _cut_to_tokens(text, head_budget) + "\n[...]\n" + _cut_to_tokens(text, tail_budget, from_end=True)
+    omitted = len(lines) - len(head) - len(tail)
+    return "\n".join(head + ["[... %d lines omitted to fit the prompt budget ...]" % omitted] + tail)
+
+
+class PromptTemplate:
+    def __init__(self, name, version, source, weights=None, max_tokens=None):
+        self.name = name
+        self.version = version
+        self.max_tokens = max_tokens or DEFAULT_MAX_PROMPT_TOKENS
+        self._parts = []
+        self.slots = []
+        for literal, field, _, _ in string.Formatter().parse(source):
+            if literal:
+                self._parts.append((literal, None))
+            if field is not None:
+                self._parts.append((None, field))
+                if field not in self.slots:
+                    self.slots.append(field)
+        self.static_tokens = sum(estimate_tokens(literal) for literal, _ in self._parts if literal)
+        self.weights = {slot: (weights or {}).get(slot, 1.0) for slot in self.slots}
+
+    def allocate(self, inputs, max_tokens=None):
+        """Split the input budget between slots: small inputs keep everything, large ones share the rest by weight."""
+        available = max(0, (max_tokens or self.max_tokens) - self.static_tokens)
+        needs = {slot: estimate_tokens(inputs[slot]) for slot in self.slots}
+        budgets = {}
+        remaining = list(self.slots)
+        while remaining:
+            total_weight = sum(self.weights[slot] for slot in remaining)
+            shares = {slot: available * self.weights[slot] / total_weight for slot in remaining}
+            satisfied = [slot for slot in remaining if needs[slot] <= shares[slot]]
+            if not satisfied:
+                for slot in remaining:
+                    budgets[slot] = int(shares[slot])
+                break
+            for slot in satisfied:
+                budgets[slot] = needs[slot]
+                available -= needs[slot]
+                remaining.remove(slot)
+        return budgets
+
+    def render(self, max_tokens=None, **inputs):
+        with stage("prompt_build"):
+            rendered = self._render(max_tokens, inputs)
+        observe("cv_prompt_tokens", rendered.tokens, template=self.name)
+        return rendered
+
+    def _render(self, max_tokens, inputs):
+        budgets = self.allocate(inputs, max_tokens)
+        values = {}
+        truncated = {}
+        for slot in self.slots:
+            value = inputs[slot] or ""
+            fitted = fit_text(value, budgets[slot])
+            if fitted is not value:
+                truncated[slot] = (estimate_tokens(value), estimate_tokens(fitted))
+            values[slot] = fitted
+        text = "".join(literal if literal is not None else values[field] for literal, field in self._parts)
+        input_tokens = sum(estimate_tokens(values[slot]) for slot in self.slots)
+        rendered = RenderedPrompt(text, self.static_tokens + input_tokens, self.static_tokens, input_tokens, truncated)
+        logger.info(
+            "prompt %s (%s): %d tokens (%d static, %d input)%s",
+            self.name, self.version, rendered.tokens, rendered.static_tokens, rendered.input_tokens,
+            "".join(" %s trimmed %d->%d" % (slot, before, after) for slot, (before, after) in truncated.items()),
+        )
+        return rendered
+
+
+@lru_cache(maxsize=None)
+def _compile(name, version, source, weights, max_tokens):
+    return PromptTemplate(name, version, source, dict(weights), max_tokens)
+
+
+def compile_template(name, version, source, weights=None, max_tokens=None):
+    """Return the compiled template, reusing it across Streamlit reruns of the app script."""
+    return _compile(name, version, source, tuple(sorted((weights or {}).items())), max_tokens)
@@ -0,0 +1,246 @@
+"""Sparse TF-IDF index for ranking already-extracted CVs against a job description.
+
+    python -m cv_ats.ranking_index add --index cv_index cvs/*.pdf
+    python -m cv_ats.ranking_index query --index cv_index --jd job.txt -k 20
+    python -m cv_ats.ranking_index remove --index cv_index cvs/old.pdf
+
+Terms are hashed into a fixed number of buckets, so documents can be added
+or removed without rebuilding a vocabulary. Each CV is stored as a row of
+log-scaled term frequencies in CSR form (`data`, `indices`, `indptr` .npy
+files) which are memory-mapped on load; document frequencies are kept
+alongside, and IDF weighting and row norms are applied at query time with a
+handful of vectorized NumPy operations. Queries are scored in blocks of
+SCORE_CHUNK_JOBS job descriptions against runs of CVs holding about
+SCORE_CHUNK_TERMS stored terms, so memory stays bounded however many jobs
+and CVs there are, and the memory-mapped arrays are read a run at a time.
+Only the top-k candidates then need the expensive LLM tailoring step.
+"""
+
+import argparse
+import json
+import os
+import sys
+import zlib
+
+import numpy as np
+
+from .keywords import STOPWORDS, tokenize
+
+DEFAULT_BUCKETS = 1 << 18
+SCORE_CHUNK_JOBS = int(os.getenv("RANKING_CHUNK_JOBS", "32"))
+SCORE_CHUNK_TERMS = int(os.getenv("RANKING_CHUNK_TERMS", str(1 << 18)))
+
+
+def hashed_terms(text, buckets):
+    tokens = [t for t in tokenize(text) if t not in STOPWORDS]
+    terms = tokens + [" ".join(pair) for pair in zip(tokens, tokens[1:])]
+    if not terms:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    # crc32 rather than hash(): bucket ids must be stable across processes
+    ids = np.fromiter((zlib.crc32(t.encode("utf-8")) % buckets for t in terms), dtype=np.int64, count=len(terms))
+    indices, counts = np.unique(ids, return_counts=True)
+    return indices.astype(np.int32), (1.0 + np.log(counts)).astype(np.float32)
+
+
+class RankingIndex:
+    def __init__(self, path, buckets=DEFAULT_BUCKETS):
+        self.path = path
+        self.buckets = buckets
+        self.doc_ids = []
+        self.data = np.zeros(0, dtype=np.float32)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.df = np.zeros(buckets, dtype=np.int32)
+        self._rows = {}
+        self._pending = []
+        self._removed = set()
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(path, buckets=meta["buckets"])
+        index.doc_ids = meta["doc_ids"]
+        index._rows = {doc_id: row for row, doc_id in enumerate(index.doc_ids)}
+        mode = "r" if mmap else None
+        index.data = np.load(os.path.join(path, "data.npy"), mmap_mode=mode)
+        index.indices = np.load(os.path.join(path, "indices.npy"), mmap_mode=mode)
+        index.indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode=mode)
+        index.df = np.array(np.load(os.path.join(path, "df.npy")))
+        return index
+
+    @classmethod
+    def open(cls, path, buckets=DEFAULT_BUCKETS):
+        if os.path.exists(os.path.join(path, "meta.json")):
+            return cls.load(path)
+        return cls(path, buckets=buckets)
+
+    def __len__(self):
+        return len(self.doc_ids) + len(self._pending) - len(self._removed)
+
+    def __contains__(self, doc_id):
+        if any(pending[0] == doc_id for pending in self._pending):
+            return True
+        return doc_id in self._rows and doc_id not in self._removed
+
+    def add(self, doc_id, text):
+        if doc_id in self:
+            self.remove(doc_id)
+        indices, weights = hashed_terms(text, self.buckets)
+        self._pending.append((doc_id, indices, weights))
+        self.df[indices] += 1
+
+    def remove(self, doc_id):
+        for i, (pending_id, indices, _) in enumerate(self._pending):
+            if pending_id == doc_id:
+                self.df[indices] -= 1
+                del self._pending[i]
+                return True
+        if doc_id in self._rows and doc_id not in self._removed:
+            row = self._rows[doc_id]
+            self.df[self.indices[self.indptr[row]:self.indptr[row + 1]]] -= 1
+            self._removed.add(doc_id)
+            return True
+        return False
+
+    def _compact(self):
+        """Fold pending additions and removals into fresh CSR arrays."""
+        keep = [row for row, doc_id in enumerate(self.doc_ids) if doc_id not in self._removed]
+        starts, stops = self.indptr[:-1][keep], self.indptr[1:][keep]
+        rows_data = [self.data[a:b] for a, b in zip(starts, stops)] + [w for _, _, w in self._pending]
+        rows_indices = [self.indices[a:b] for a, b in zip(starts, stops)] + [i for _, i, _ in self._pending]
+        lengths = np.fromiter((len(r) for r in rows_indices), dtype=np.int64, count=len(rows_indices))
+        self.doc_ids = [self.doc_ids[row] for row in keep] + [doc_id for doc_id, _, _ in self._pending]
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.doc_ids)}
+        self.data = np.concatenate(rows_data).astype(np.float32) if rows_data else np.zeros(0, np.float32)
+        self.indices = np.concatenate(rows_indices).astype(np.int32) if rows_indices else np.zeros(0, np.int32)
+        self.indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self._pending = []
+        self._removed = set()
+
+    def save(self):
+        if self._pending or self._removed:
+            self._compact()
+        os.makedirs(self.path, exist_ok=True)
+        # Write to temporary names first so a crash never leaves a half-written index
+        arrays = {"data": self.data, "indices": self.indices, "indptr": self.indptr, "df": self.df}
+        for name, array in arrays.items():
+            np.save(os.path.join(self.path, name + ".tmp.npy"), np.asarray(array))
+        meta_tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump({"buckets": self.buckets, "doc_ids": self.doc_ids}, f)
+        for name in arrays:
+            os.replace(os.path.join(self.path, name + ".tmp.npy"), os.path.join(self.path, name + ".npy"))
+        os.replace(meta_tmp, os.path.join(self.path, "meta.json"))
+
+    def scores(self, job_texts):
+        """Cosine similarities as a (len(job_texts), len(index)) array."""
+        if self._pending or self._removed:
+            self._compact()
+        n_docs = len(self.doc_ids)
+        idf = np.log((1.0 + n_docs) / (1.0 + self.df)).astype(np.float32) + 1.0
+        result = np.zeros((len(job_texts), n_docs))
+        for first in range(0, len(job_texts), SCORE_CHUNK_JOBS):
+            queries = self._queries(job_texts[first:first + SCORE_CHUNK_JOBS], idf)
+            for start, stop in self._row_chunks(SCORE_CHUNK_TERMS):
+                result[first:first + len(queries), start:stop] = self._score_rows(queries, idf, start, stop)
+        return result
+
+    def _queries(self, job_texts, idf):
+        queries = np.zeros((len(job_texts), self.buckets), dtype=np.float32)
+        for row, job_text in enumerate(job_texts):
+            q_indices, q_weights = hashed_terms(job_text, self.buckets)
+            queries[row, q_indices] = q_weights * idf[q_indices]
+        q_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        np.divide(queries, q_norms, out=queries, where=q_norms > 0)
+        return queries
+
+    def _row_chunks(self, terms):
+        # Contiguous row ranges holding about `terms` stored terms each; a longer row gets a range to itself
+        start = 0
+        while start < len(self.doc_ids):
+            stop = int(np.searchsorted(self.indptr, self.indptr[start] + terms, side="right")) - 1
+            stop = min(max(stop, start + 1), len(self.doc_ids))
+            yield start, stop
+            start = stop
+
+    def _score_rows(self, queries, idf, start, stop):
+        first, last = self.indptr[start], self.indptr[stop]
+        indptr = np.asarray(self.indptr[start:stop + 1]) - first
+        result = np.zeros((len(queries), stop - start))
+        non_empty = np.diff(indptr) > 0
+        if not non_empty.any():
+            return result
+        # Sparse row-by-query products for these CVs and every job in the block:
+        # gather the query weights at each stored term, then sum per CSR row.
+        indices = np.asarray(self.indices[first:last])
+        weighted = np.asarray(self.data[first:last]) * idf[indices]
+        starts = indptr[:-1][non_empty]
+        dots = np.add.reduceat(queries[:, indices] * weighted, starts, axis=1)
+        norms = np.sqrt(np.add.reduceat(weighted * weighted, starts))
+        result[:, non_empty] = dots / norms
+        return result
+
+    def top_k_many(self, job_texts, k=10):
+        """For each job text, [(doc_id, cosine similarity)] of the k best-matching CVs."""
+        scores = self.scores(job_texts)
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return [[] for _ in job_texts]
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        ranked = []
+        for row, candidates in enumerate(best):
+            candidates = candidates[np.argsort(-scores[row, candidates], kind="stable")]
+            ranked.append([(self.doc_ids[i], float(scores[row, i])) for i in candidates if scores[row, i] > 0])
+        return ranked
+
+    def top_k(self, job_text, k=10):
+        return self.top_k_many([job_text], k)[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain and query the CV ranking index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    # Documents are identified by their absolute path, which is what cv_ats.batch --top-k looks up
+    add = sub.add_parser("add", help="Extract and index PDFs (re-adding a path replaces it)")
+    add.add_argument("pdfs", nargs="+")
+    remove = sub.add_parser("remove", help="Drop documents from the index")
+    remove.add_argument("doc_ids", nargs="+", metavar="pdf")
+    query = sub.add_parser("query", help="Rank indexed CVs against a job description")
+    query.add_argument("--jd", required=True, help="Text file with the job description")
+    query.add_argument("-k", type=int, default=10)
+    for command in (add, remove, query):
+        command.add_argument("--index", required=True, help="Index directory")
+    args = parser.parse_args(argv)
+
+    index = RankingIndex.open(args.index)
+    if args.command == "add":
+        # PyMuPDF is only needed when adding documents
+        from .pdf_cache import pdf_text_cache, read_upload
+        from .pdf_extract import PdfRejected, extract_text
+
+        for path in args.pdfs:
+            try:
+                with open(path, "rb") as f:
+                    text = pdf_text_cache.get_or_extract(read_upload(f), extract_text)
+            except PdfRejected as exc:
+                print("skipped %s: %s" % (path, exc), file=sys.stderr)
+                continue
+            index.add(os.path.abspath(path), text)
+        index.save()
+        print("%d documents indexed" % len(index), file=sys.stderr)
+    elif args.command == "remove":
+        for doc_id in args.doc_ids:
+            if not index.remove(os.path.abspath(doc_id)):
+                print("not indexed: %s" % doc_id, file=sys.stderr)
+        index.save()
+    else:
+        with open(args.jd, "r", encoding="utf-8") as f:
+            job_text = f.read()
+        for doc_id, score in index.top_k(job_text, args.k):
+            print("%.4f\t%s" % (score, doc_id))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
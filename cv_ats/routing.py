@@ -0,0 +1,73 @@
+"""Cascade routing between a fast model and a stronger one.
+
+With MODEL_ROUTING=1 each model call goes to ROUTER_LITE_MODEL instead of
+the profile's model, unless a heuristic escalates it to ROUTER_PRO_MODEL:
+
+- "cv_length": the text being rewritten is over ROUTER_MAX_LITE_TOKENS;
+- "low_coverage": a tailoring step for a CV that covers less than
+  ROUTER_MIN_COVERAGE of the job's keywords (see keywords.py);
+- "validation": the fast model's output failed `Router.valid` (empty, or
+  shorter than ROUTER_MIN_OUTPUT_RATIO of its input), so the call is made
+  again on the pro model. A streamed answer is judged once it has streamed
+  and the pro model's answer then replaces it on the page. The invalid
+  answer is not cached; the escalation is, so a repeat of the request
+  goes straight to the pro model's cached answer.
+
+Job analysis only extracts keywords and always stays on the fast model.
+Decisions are counted in cv_route_decisions_total by step, model and
+reason (and on the current request's record); per-model latency and token
+totals are the model-labelled cv_model_* metrics, see `model_totals`.
+"""
+
+import logging
+import os
+
+from .metrics import inc
+from .prompt_templates import estimate_tokens
+
+LITE_MODEL = os.getenv("ROUTER_LITE_MODEL", "gemini-2.0-flash-lite")
+PRO_MODEL = os.getenv("ROUTER_PRO_MODEL", "gemini-1.5-pro")
+MAX_LITE_TOKENS = int(os.getenv("ROUTER_MAX_LITE_TOKENS", "3000"))
+MIN_COVERAGE = float(os.getenv("ROUTER_MIN_COVERAGE", "0.4"))
+MIN_OUTPUT_RATIO = float(os.getenv("ROUTER_MIN_OUTPUT_RATIO", "0.5"))
+
+# Steps that never escalate on length or coverage
+LITE_ONLY_STEPS = {"job_analysis"}
+
+logger = logging.getLogger(__name__)
+
+
+class Router:
+    def __init__(self, lite_model=LITE_MODEL, pro_model=PRO_MODEL, max_lite_tokens=MAX_LITE_TOKENS,
+                 min_coverage=MIN_COVERAGE, min_output_ratio=MIN_OUTPUT_RATIO):
+        self.lite_model = lite_model
+        self.pro_model = pro_model
+        self.max_lite_tokens = max_lite_tokens
+        self.min_coverage = min_coverage
+        self.min_output_ratio = min_output_ratio
+
+    def choose(self, step, text, coverage=None):
+        """The model name for `step` on input `text`, given the CV's keyword coverage where there is a job."""
+        if step not in LITE_ONLY_STEPS:
+            if self.max_lite_tokens and estimate_tokens(text) > self.max_lite_tokens:
+                return self._decide(step, self.pro_model, "cv_length")
+            if coverage is not None and coverage < self.min_coverage:
+                return self._decide(step, self.pro_model, "low_coverage")
+        return self._decide(step, self.lite_model, "default")
+
+    def valid(self, output, text):
+        output = (output or "").strip()
+        return bool(output) and len(output) >= self.min_output_ratio * len(text.strip())
+
+    def escalate(self, step):
+        return self._decide(step, self.pro_model, "validation")
+
+    def _decide(self, step, model_name, reason):
+        inc("cv_route_decisions_total", step=step, model=model_name, reason=reason)
+        logger.debug("route %s -> %s (%s)", step, model_name, reason)
+        return model_name
+
+
+def default_router():
+    """A Router configured from the environment, or None when MODEL_ROUTING is off."""
+    return Router() if os.getenv("MODEL_ROUTING", "0") == "1" else None
@@ -0,0 +1,289 @@
+"""Quota-aware scheduling in front of every model call.
+
+`ScheduledBackend` wraps any backend from backends.py. Before a call is
+sent it waits for:
+
+- a concurrency slot: the limit adapts to what the service tolerates,
+  halving on throttling (429/503) or slow responses and creeping back up by
+  one slot per `limit` successes (AIMD);
+- its turn: waiting interactive requests are admitted before batch ones
+  (set with `with priority(BATCH):`, or `set_priority` for a whole worker
+  thread; it follows whatever the thread runs via `contextvars.copy_context()`),
+  among the calls queued in the same process;
+- the requests-per-minute and tokens-per-minute buckets. Tokens are charged
+  up front from the prompt estimate plus LLM_EXPECTED_OUTPUT_TOKENS and
+  corrected from the response's usage metadata.
+
+Transient failures (429, 5xx, timeouts) are retried with full-jitter
+exponential backoff, LLM_MAX_RETRIES times. A stream is retried as long as
+it has not yielded anything yet. Limits come from LLM_RPM and LLM_TPM (0
+means unlimited), LLM_MAX_CONCURRENCY, LLM_MIN_CONCURRENCY and
+LLM_LATENCY_TARGET (seconds, 0 disables the latency signal); schedulers are
+shared per model name, since that is how quotas are counted.
+
+The buckets and the queue are per process. cv_ats.batch runs in its own
+process next to the Streamlit server, so its calls don't queue behind the
+UI's. Instead, batch takes its own budget from BATCH_LLM_RPM and
+BATCH_LLM_TPM (falling back to LLM_RPM and LLM_TPM); split the API key's
+quota between the two so that together they stay under it.
+"""
+
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from .backends import ModelBackend
+from .metrics import inc, observe
+from .prompt_templates import estimate_tokens
+from .streaming import cancel_stream
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BATCH = 0, 1
+TRANSIENT_STATUSES = frozenset((429, 500, 502, 503, 504))
+THROTTLE_STATUSES = frozenset((429, 503))
+
+_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+# Set by cv_ats.batch: this process spends the batch budget
+_batch_process = False
+
+
+def set_priority(level):
+    _priority.set(level)
+
+
+def use_batch_budget():
+    """Take RPM/TPM limits from BATCH_LLM_RPM/BATCH_LLM_TPM in this process; call before any model call."""
+    global _batch_process
+    _batch_process = True
+
+
+def _quota(name):
+    value = os.getenv("BATCH_" + name) if _batch_process else None
+    return int(value if value is not None else os.getenv(name, "0"))
+
+
+@contextmanager
+def priority(level):
+    """Schedule the model calls made inside the block at `level` (INTERACTIVE or BATCH)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def error_status(exc):
+    """The HTTP status of an upstream error (Gemini and FakeBackend errors carry `.code`), or None."""
+    for attr in ("code", "status", "status_code"):
+        value = getattr(exc, attr, None)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def is_transient(exc):
+    return error_status(exc) in TRANSIENT_STATUSES or isinstance(exc, (TimeoutError, ConnectionError))
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        """Take `amount` now, going into debt if needed, and return how long to wait for the debt to clear."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Scheduler:
+    def __init__(self, name="", rpm=0, tpm=0, max_concurrency=8, min_concurrency=1, max_retries=4,
+                 base_delay=1.0, max_delay=30.0, latency_target=0.0, expected_output_tokens=1000):
+        self.name = name
+        self.rpm_bucket = TokenBucket(rpm) if rpm > 0 else None
+        self.tpm_bucket = TokenBucket(tpm) if tpm > 0 else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = max(1, min_concurrency)
+        self.limit = float(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_target = latency_target
+        self.expected_output_tokens = expected_output_tokens
+        self.in_flight = 0
+        self.counters = {"calls": 0, "retries": 0, "throttled": 0, "failed": 0}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._last_decrease = 0.0
+        self._random = random.Random()
+        self._condition = threading.Condition()
+
+    def acquire(self, tokens):
+        """Wait for a slot and for quota; returns the number of tokens charged."""
+        entry = (_priority.get(), next(self._sequence))
+        queued_at = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            while self._waiting[0] != entry or self.in_flight >= max(self.min_concurrency, int(self.limit)):
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            self.in_flight += 1
+            self.counters["calls"] += 1
+            now = time.monotonic()
+            # Reserving in admission order keeps the priorities when quota is the bottleneck
+            wait = self.rpm_bucket.reserve(1, now) if self.rpm_bucket else 0.0
+            if self.tpm_bucket:
+                wait = max(wait, self.tpm_bucket.reserve(tokens, now))
+            self._condition.notify_all()
+        if wait > 0:
+            logger.info("waiting %.1fs for the request/token quota", wait)
+            time.sleep(wait)
+        observe("cv_scheduler_wait_seconds", time.monotonic() - queued_at, model=self.name)
+        return tokens
+
+    def release(self, charged, started, error=None, used_tokens=None):
+        """Return the slot of a call sent at `started` (time.monotonic()) and adapt the limit to how it went."""
+        with self._condition:
+            self.in_flight -= 1
+            if used_tokens is not None and self.tpm_bucket:
+                self.tpm_bucket.refund(charged - used_tokens)
+            now = time.monotonic()
+            if error is not None and error_status(error) in THROTTLE_STATUSES:
+                self.counters["throttled"] += 1
+                self._decrease(started, now, 0.5)
+            elif error is None and self.latency_target and now - started > self.latency_target:
+                self._decrease(started, now, 0.9)
+            elif error is None:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def _decrease(self, started, now, factor):
+        # Calls sent before the last decrease were sent under the old limit; they don't cut it again
+        if started >= self._last_decrease:
+            self.limit = max(self.min_concurrency, self.limit * factor)
+            self._last_decrease = now
+
+    def backoff(self, attempt):
+        with self._condition:
+            return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def retry_or_raise(self, exc, attempt):
+        if not is_transient(exc) or attempt >= self.max_retries:
+            with self._condition:
+                self.counters["failed"] += 1
+            raise exc
+        delay = self.backoff(attempt)
+        with self._condition:
+            self.counters["retries"] += 1
+        inc("cv_model_retries_total", model=self.name)
+        logger.warning("transient model error (%s), retry %d in %.1fs", exc, attempt + 1, delay)
+        time.sleep(delay)
+
+    def stats(self):
+        with self._condition:
+            return dict(self.counters, limit=round(self.limit, 2), in_flight=self.in_flight, waiting=len(self._waiting))
+
+
+def _used_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage is not None else None
+
+
+class ScheduledStream:
+    def __init__(self, backend, prompt, kwargs):
+        self._backend = backend
+        self._prompt = prompt
+        self._kwargs = kwargs
+        self._inner = None
+
+    @property
+    def usage_metadata(self):
+        return getattr(self._inner, "usage_metadata", None)
+
+    def cancel(self):
+        if self._inner is not None:
+            cancel_stream(self._inner)
+
+    def __iter__(self):
+        scheduler = self._backend.scheduler
+        for attempt in itertools.count():
+            charged = scheduler.acquire(self._backend.estimate(self._prompt))
+            started = time.monotonic()
+            error = None
+            yielded = False
+            try:
+                self._inner = self._backend.inner.generate_content(self._prompt, stream=True, **self._kwargs)
+                for chunk in self._inner:
+                    yielded = True
+                    yield chunk
+                return
+            except Exception as exc:
+                error = exc
+                if yielded:
+                    raise
+            finally:
+                scheduler.release(charged, started, error, _used_tokens(self._inner))
+            scheduler.retry_or_raise(error, attempt)
+
+
+class ScheduledBackend(ModelBackend):
+    def __init__(self, inner, scheduler):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.scheduler = scheduler
+
+    def estimate(self, prompt):
+        return estimate_tokens(prompt) + self.scheduler.expected_output_tokens
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if stream:
+            return ScheduledStream(self, prompt, kwargs)
+        for attempt in itertools.count():
+            charged = self.scheduler.acquire(self.estimate(prompt))
+            started = time.monotonic()
+            try:
+                response = self.inner.generate_content(prompt, **kwargs)
+            except Exception as exc:
+                self.scheduler.release(charged, started, exc)
+                self.scheduler.retry_or_raise(exc, attempt)
+                continue
+            self.scheduler.release(charged, started, used_tokens=_used_tokens(response))
+            return response
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(model_name):
+    with _schedulers_lock:
+        if model_name not in _schedulers:
+            _schedulers[model_name] = Scheduler(
+                name=model_name,
+                rpm=_quota("LLM_RPM"),
+                tpm=_quota("LLM_TPM"),
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                min_concurrency=int(os.getenv("LLM_MIN_CONCURRENCY", "1")),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+                base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "1")),
+                max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "30")),
+                latency_target=float(os.getenv("LLM_LATENCY_TARGET", "0")),
+                expected_output_tokens=int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "1000")),
+            )
+        return _schedulers[model_name]
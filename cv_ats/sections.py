@@ -0,0 +1,181 @@
+"""Section-aware CV segmentation and incremental re-enhancement.
+
+`segment_pdf` uses PyMuPDF's block, line and font metadata to split a CV
+into sections (Experience, Education, Skills, ...), and each section gets a
+fingerprint of its normalized content. `enhance_changed_sections` sends the
+model only the sections whose fingerprint has no cached rewrite and stitches
+the cached rewrites back in for the rest, so a candidate who only edited
+their Skills section pays for rewriting just that section.
+"""
+
+import hashlib
+import json
+import re
+from collections import Counter, namedtuple
+
+from .llm_cache import make_key, normalize_text, response_cache
+from .pdf_extract import open_document
+from .prompt_templates import compile_template
+
+SECTION_PROMPT_VERSION = "sections-v2"
+
+_HEADING_WORDS = {
+    "about", "achievements", "activities", "awards", "certifications", "competencies", "contact", "courses",
+    "education", "employment", "experience", "history", "honors", "interests", "languages", "objective",
+    "presentations", "profile", "projects", "publications", "qualifications", "references", "skills",
+    "summary", "training", "volunteer", "volunteering", "work",
+}
+# Only allowed alongside one of the words above: "Professional Experience", "Core Competencies"
+_QUALIFIERS = {"and", "of", "career", "core", "key", "personal", "professional", "relevant", "technical"}
+
+Section = namedtuple("Section", "title text fingerprint")
+EnhancedSections = namedtuple("EnhancedSections", "text sections changed reused")
+
+SECTIONS_TEMPLATE = compile_template("sections", SECTION_PROMPT_VERSION, """
+    As an ATS (Applicant Tracking System) and CV enhancement expert, rewrite each of the CV sections below so it is optimized for ATS compatibility:
+    - Start bullet points with action verbs. {metrics_instruction}
+    - Integrate relevant keywords naturally, including both long-form and acronym versions (e.g., "certified public accountant" and "CPA").
+    - Correct typos, grammar and inconsistent formatting; use consistent date formats and plain bullet points.
+    - Keep every fact, employer, title and date; do not invent new roles or qualifications.
+
+    Return every section, in the same order, starting each with its marker line exactly as given (for example "=== SECTION 2: Skills ==="), followed by the rewritten section content only. Do not add anything before the first marker or after the last section.
+
+    {sections}
+    """, weights={"sections": 10, "metrics_instruction": 1})
+
+# The template indents the first marker; the model may echo that
+_MARKER = re.compile(r"^[ \t]*=== SECTION (\d+): .*? ===[ \t]*$", re.MULTILINE)
+
+
+def fingerprint(title, text):
+    return hashlib.sha256(normalize_text(title + "\n" + text).encode("utf-8")).hexdigest()[:16]
+
+
+def _is_known_heading(text):
+    words = re.findall(r"[a-z]+", text.lower())
+    if not words or len(words) > 4:
+        return False
+    return all(w in _HEADING_WORDS or w in _QUALIFIERS for w in words) and any(w in _HEADING_WORDS for w in words)
+
+
+def _looks_like_heading(text, size, bold, body_size):
+    text = text.strip()
+    if not text or len(text) > 50 or len(text.split()) > 6 or text[-1] in ".,;":
+        return False
+    if _is_known_heading(text.rstrip(":")):
+        return True
+    emphasized = bold or (text.isupper() and len(text) > 3)
+    return emphasized and size >= body_size * 1.1
+
+
+def _group(lines, heading_flags):
+    sections = []
+    title, body = "", []
+    for (text, _, _), is_heading in zip(lines, heading_flags):
+        if is_heading:
+            if title or any(line.strip() for line in body):
+                sections.append((title, "\n".join(body).strip()))
+            title, body = text.strip().rstrip(":"), []
+        else:
+            body.append(text)
+    if title or any(line.strip() for line in body):
+        sections.append((title, "\n".join(body).strip()))
+    return [Section(t, b, fingerprint(t, b)) for t, b in sections]
+
+
+def segment_pdf(data):
+    """Split a PDF CV into Sections using font size and weight to find headings."""
+    lines = []
+    with open_document(data) as doc:
+        for page in doc:
+            for block in page.get_text("dict")["blocks"]:
+                for line in block.get("lines", ()):
+                    spans = [span for span in line["spans"] if span["text"].strip()]
+                    if not spans:
+                        continue
+                    text = "".join(span["text"] for span in line["spans"])
+                    size = max(span["size"] for span in spans)
+                    # flags bit 4 marks bold text; some fonts only say so in their name
+                    bold = all(span["flags"] & 16 or "bold" in span["font"].lower() for span in spans)
+                    lines.append((text, size, bold))
+    if not lines:
+        return []
+    sizes = Counter()
+    for text, size, _ in lines:
+        sizes[round(size * 2) / 2] += len(text)
+    body_size = sizes.most_common(1)[0][0]
+    return _group(lines, [_looks_like_heading(text, size, bold, body_size) for text, size, bold in lines])
+
+
+def is_text_heading(line):
+    """Whether a plain-text line looks like a heading: a known section name or a short all-caps line."""
+    line = line.strip()
+    return bool(line) and len(line) <= 50 and (
+        _is_known_heading(line.rstrip(":")) or (line.isupper() and len(line) > 3)
+    )
+
+
+def segment_text(text):
+    """Fallback for plain text, split at the lines is_text_heading accepts."""
+    lines = [(line, 0, False) for line in text.splitlines()]
+    return _group(lines, [is_text_heading(line) for line, _, _ in lines])
+
+
+def cached_sections(cache, data):
+    """Segment `data` through the PDF cache, under a key separate from the plain text."""
+    raw = cache.get_or_extract(data, lambda d: json.dumps(segment_pdf(d)), namespace="sections")
+    return [Section(*section) for section in json.loads(raw)]
+
+
+def stitch(sections):
+    return "\n\n".join(("%s\n%s" % (s.title, s.text) if s.title else s.text).strip() for s in sections)
+
+
+def parse_sections(response, numbers):
+    """Map marker number -> rewritten content for the markers present in `response`."""
+    found = {}
+    matches = list(_MARKER.finditer(response))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(response)
+        number = int(match.group(1))
+        if number in numbers:
+            found[number] = response[match.end():end].strip()
+    return found
+
+
+def enhance_changed_sections(model, model_name, sections, metrics_instruction, cache=response_cache):
+    """Rewrite only sections without a cached rewrite, in one model call, and stitch the CV back together.
+
+    `metrics_instruction` is the profile's rule for quantifying bullets (see profiles.py).
+    """
+    keys = [make_key(model_name, SECTION_PROMPT_VERSION, metrics_instruction, s.title, s.text) for s in sections]
+    rewritten = {}
+    changed = []
+    reused = 0
+    for i, (section, key) in enumerate(zip(sections, keys)):
+        cached = cache.get(key)
+        if cached is not None:
+            rewritten[i] = cached
+            reused += 1
+        elif section.text:
+            changed.append(i)
+        else:
+            rewritten[i] = section.text
+
+    if changed:
+        blocks = "\n\n".join(
+            "=== SECTION %d: %s ===\n%s" % (i + 1, sections[i].title or "Header", sections[i].text) for i in changed
+        )
+        prompt = SECTIONS_TEMPLATE.render(sections=blocks, metrics_instruction=metrics_instruction)
+        response = model.generate_content(prompt.text).text
+        parsed = parse_sections(response, {i + 1 for i in changed})
+        for i in changed:
+            if i + 1 in parsed and parsed[i + 1]:
+                rewritten[i] = parsed[i + 1]
+                cache.put(keys[i], model_name, SECTION_PROMPT_VERSION, parsed[i + 1])
+            else:
+                # The model skipped or mangled this section; keep the original and retry it next time
+                rewritten[i] = sections[i].text
+
+    result = [Section(s.title, rewritten[i], s.fingerprint) for i, s in enumerate(sections)]
+    return EnhancedSections(stitch(result), result, len(changed), reused)
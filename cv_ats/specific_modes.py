@@ -0,0 +1,158 @@
+"""Execution modes for the job-specific enhancement.
+
+- "sequential": the original two calls, general rewrite then tailoring.
+- "fused": one call that does the general and the job-specific rewrite together,
+  given the job keywords the CV is missing (see keywords.py).
+- "overlapped": the job description is analysed (required keywords and
+  qualifications) while the general pass runs; the tailoring call then works
+  from that compact analysis instead of the raw job description.
+
+SPECIFIC_MODE sets the default. `cv_ats.bench --stages specific specific_fused
+specific_overlapped` compares their latency and token use.
+
+`fan_out` runs the tailoring for several job descriptions at once, at most
+FANOUT_CONCURRENCY at a time, after a single shared general pass (see
+Pipeline.improve_cv_specific_many).
+"""
+
+import contextvars
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .keywords import analyze, format_gaps
+from .llm_cache import response_cache
+from .prompt_templates import compile_template
+from .streaming import cached_stream, stream_text
+
+MODES = ("sequential", "fused", "overlapped")
+DEFAULT_MODE = os.getenv("SPECIFIC_MODE", "sequential")
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "4"))
+
+Tailored = namedtuple("Tailored", "index output error")
+
+# Appended to an app's general prompt (which ends with the original CV) to build its fused prompt
+FUSED_SUFFIX = """
+
+    ### Target Job Description Keywords Missing From the CV:
+    {keyword_gaps}
+
+    ### Minimum Qualification:
+    {minimum_qualification}
+
+    Apply all of the optimization instructions above and, in the same pass, tailor the CV to the target job description. Ensure that the CV is tailored to match the job requirements while maintaining its ATS-friendly format.
+
+    Please provide:
+    1. A version of the CV optimized for ATS and tailored specifically for this job description, highlighting relevant skills and experiences.
+    2. A list of key changes made, covering both the general ATS improvements and the alignment with the job description.
+    3. Additional suggestions for making the CV stand out for this particular role.
+    """
+
+ANALYSIS_TEMPLATE = compile_template("job-analysis", "job-analysis-v1", """
+    As an ATS (Applicant Tracking System) expert, analyse the following job description and minimum qualification. Reply with concise bullet lists only, no commentary:
+    - Required keywords and hard skills, including both the long form and the acronym where one exists (e.g., "certified public accountant" and "CPA")
+    - Soft skills
+    - Minimum qualifications (education, certifications, years of experience)
+    - Preferred qualifications
+
+    ### Job Description:
+    {job_description}
+
+    ### Minimum Qualification:
+    {minimum_qualification}
+    """, weights={"job_description": 3, "minimum_qualification": 1})
+
+TAILOR_FROM_ANALYSIS_TEMPLATE = compile_template("tailor-from-analysis", "tailor-from-analysis-v1", """
+    As an ATS (Applicant Tracking System) and CV enhancement expert, please review the following improved CV and further optimize it for the job whose requirements are summarized below. Ensure that the CV is tailored to match the job requirements while maintaining its ATS-friendly format.
+
+    ### Job Requirements:
+    {job_analysis}
+
+    ### Minimum Qualification:
+    {minimum_qualification}
+
+    ### Improved CV:
+    {improved_cv}
+
+    Please provide:
+    1. A version of the CV tailored specifically for this job, highlighting relevant skills and experiences.
+    2. A list of key changes made to align the CV with the job requirements.
+    3. Additional suggestions for making the CV stand out for this particular role.
+    """, weights={"improved_cv": 6, "job_analysis": 3, "minimum_qualification": 1})
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("OVERLAP_WORKERS", "8")), thread_name_prefix="job-analysis")
+
+
+def check_mode(mode):
+    mode = mode or DEFAULT_MODE
+    if mode not in MODES:
+        raise ValueError("Unknown execution mode %r, expected one of %s" % (mode, ", ".join(MODES)))
+    return mode
+
+
+def fan_out(fn, count, max_workers=None):
+    """Call `fn(i)` for each of `count` targets, at most `max_workers` at a time; yield a Tailored as each completes."""
+    # Each call runs in a copy of the caller's context, keeping its scheduling priority and metrics request
+    with ThreadPoolExecutor(max_workers=max_workers or FANOUT_CONCURRENCY, thread_name_prefix="fan-out") as pool:
+        futures = {pool.submit(contextvars.copy_context().run, fn, i): i for i in range(count)}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield Tailored(futures[future], None if error is not None else future.result(), error)
+
+
+def analyze_job(model, model_name, job_description, minimum_qualification):
+    prompt = ANALYSIS_TEMPLATE.render(job_description=job_description, minimum_qualification=minimum_qualification)
+    return response_cache.get_or_generate(
+        model_name, ANALYSIS_TEMPLATE.version, (job_description, minimum_qualification),
+        lambda: model.generate_content(prompt.text).text,
+    )
+
+
+def start_job_analysis(model, model_name, job_description, minimum_qualification):
+    """Run analyze_job in the background and return its Future."""
+    # Copy the context so the call keeps the caller's scheduling priority
+    return _executor.submit(
+        contextvars.copy_context().run, analyze_job, model, model_name, job_description, minimum_qualification
+    )
+
+
+def tailor_from_analysis(model, model_name, improved_cv, job_analysis, minimum_qualification):
+    prompt = TAILOR_FROM_ANALYSIS_TEMPLATE.render(
+        improved_cv=improved_cv, job_analysis=job_analysis, minimum_qualification=minimum_qualification
+    )
+    return response_cache.get_or_generate(
+        model_name, TAILOR_FROM_ANALYSIS_TEMPLATE.version, (improved_cv, job_analysis, minimum_qualification),
+        lambda: model.generate_content(prompt.text).text,
+    )
+
+
+def tailor_from_analysis_stream(model, model_name, improved_cv, job_analysis, minimum_qualification, timings=None):
+    prompt = TAILOR_FROM_ANALYSIS_TEMPLATE.render(
+        improved_cv=improved_cv, job_analysis=job_analysis, minimum_qualification=minimum_qualification
+    )
+    return cached_stream(
+        response_cache, model_name, TAILOR_FROM_ANALYSIS_TEMPLATE.version,
+        (improved_cv, job_analysis, minimum_qualification),
+        lambda: stream_text(model, prompt.text, timings),
+    )
+
+
+def render_fused(template, cv_text, job_description, minimum_qualification):
+    keyword_gaps = format_gaps(analyze(cv_text, job_description, minimum_qualification))
+    return template.render(cv_text=cv_text, keyword_gaps=keyword_gaps, minimum_qualification=minimum_qualification)
+
+
+def run_fused(model, model_name, template, cv_text, job_description, minimum_qualification):
+    prompt = render_fused(template, cv_text, job_description, minimum_qualification)
+    return response_cache.get_or_generate(
+        model_name, template.version, (cv_text, job_description, minimum_qualification),
+        lambda: model.generate_content(prompt.text).text,
+    )
+
+
+def run_fused_stream(model, model_name, template, cv_text, job_description, minimum_qualification, timings=None):
+    prompt = render_fused(template, cv_text, job_description, minimum_qualification)
+    return cached_stream(
+        response_cache, model_name, template.version, (cv_text, job_description, minimum_qualification),
+        lambda: stream_text(model, prompt.text, timings),
+    )
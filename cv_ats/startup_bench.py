@@ -0,0 +1,146 @@
+"""Startup benchmark: cold import time and per-rerun overhead of the apps.
+
+    python -m cv_ats.startup_bench --runs 5
+    python -m cv_ats.startup_bench --modules cv_ats.pipeline app_3 --json
+
+Cold imports are timed in fresh interpreters, one per run, and report which
+heavy dependencies each module pulled in (none of them should be loaded
+before a model call or a PDF needs them). The rerun figures are measured in
+this process: what Streamlit pays when it re-executes an app script after
+the first run, next to what rebuilding the pipeline each time would cost.
+The first model client creation is timed separately; set CV_BACKEND=fake to
+measure it without the Gemini client.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from .pipeline import Pipeline, get_pipeline
+from .profiles import DEFAULT_PROFILE, PROFILES, get_profile
+from .prompt_templates import _compile
+
+HEAVY_MODULES = ("google.generativeai", "fitz", "pymupdf", "numpy", "streamlit")
+DEFAULT_MODULES = ("cv_ats", "cv_ats.pipeline", "cv_ats.ui", "app_1", "app_2", "app_3")
+APP_SCRIPTS = {"app_1": "seven-section", "app_2": "bracketed", "app_3": "thirty-section"}
+
+# Runs in the child interpreter: argv[1] is the module to import
+IMPORT_SCRIPT = """
+import importlib, json, sys, time
+started = time.perf_counter()
+try:
+    importlib.import_module(sys.argv[1])
+    error = None
+except Exception as exc:
+    error = "%s: %s" % (type(exc).__name__, exc)
+seconds = time.perf_counter() - started
+heavy = [name for name in sys.argv[2:] if name in sys.modules]
+print(json.dumps({"seconds": seconds, "heavy": heavy, "error": error}))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cold_import(module, runs):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    times = []
+    result = {}
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT, module] + list(HEAVY_MODULES),
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if result["error"]:
+            break
+        times.append(result["seconds"])
+    return {
+        "median_ms": statistics.median(times) * 1000 if times else float("nan"),
+        "heavy": result.get("heavy", []),
+        "error": result.get("error"),
+    }
+
+
+def median_ms(fn, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def rerun_overhead(script, profile, runs):
+    # Streamlit runs the script as __main__; another name skips main() and times just the module body
+    path = os.path.join(ROOT, script + ".py")
+    with open(path, "r", encoding="utf-8") as f:
+        source = f.read()
+
+    def rerun():
+        exec(compile(source, path, "exec"), {"__name__": "__rerun__", "__file__": path})
+        get_pipeline(profile)
+
+    try:
+        rerun()
+    except ImportError as exc:
+        # The shims import cv_ats.ui, which needs Streamlit
+        return {"rerun_ms": float("nan"), "error": "%s: %s" % (type(exc).__name__, exc)}
+    return {"rerun_ms": median_ms(rerun, runs), "error": None}
+
+
+def rebuild(profile):
+    _compile.cache_clear()
+    return Pipeline(get_profile(profile))
+
+
+def client_creation(profile):
+    pipeline = Pipeline(get_profile(profile))
+    started = time.perf_counter()
+    try:
+        pipeline.model
+    except Exception as exc:
+        return {"client_ms": float("nan"), "error": "%s: %s" % (type(exc).__name__, exc)}
+    return {"client_ms": (time.perf_counter() - started) * 1000, "error": None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark cold-start and per-rerun overhead of the apps.")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per measurement (the median is reported)")
+    parser.add_argument("--modules", nargs="+", default=list(DEFAULT_MODULES), help="Modules to cold-import")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE,
+                        help="Profile for the client creation timing (%s)" % ", ".join(PROFILES))
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per result instead of a table")
+    args = parser.parse_args(argv)
+
+    def report(kind, name, value, detail):
+        if args.json:
+            print(json.dumps({"kind": kind, "name": name, "ms": value, "detail": detail}))
+        else:
+            print("%-14s %-18s %10.2f  %s" % (kind, name, value, detail))
+
+    if not args.json:
+        print("%-14s %-18s %10s  %s" % ("measure", "name", "median ms", "detail"))
+    for module in args.modules:
+        result = cold_import(module, args.runs)
+        detail = result["error"] or "loaded: %s" % (", ".join(result["heavy"]) or "-")
+        report("cold_import", module, result["median_ms"], detail)
+
+    for script, profile in APP_SCRIPTS.items():
+        result = rerun_overhead(script, profile, args.runs)
+        report("rerun", script, result["rerun_ms"], result["error"] or "")
+    for profile in PROFILES:
+        # What a rerun would pay if nothing were kept between runs, not counting the model client
+        report("rebuild", profile, median_ms(lambda: rebuild(profile), args.runs), "templates compiled from scratch")
+
+    result = client_creation(args.profile)
+    report("client", args.profile, result["client_ms"], result["error"] or "")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
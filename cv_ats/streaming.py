@@ -0,0 +1,115 @@
+"""Streaming generation helpers.
+
+`stream_text` yields chunks as the model produces them and records
+time-to-first-token and total time. Closing the generator early cancels
+the upstream request instead of letting it run to completion. Generation
+runs in background jobs, which close it when the job is cancelled (see
+jobs.py); the page's Stop button and reruns no longer reach it.
+
+A routed stream (Pipeline.generate_stream) may yield RESTART: the text so
+far failed validation and is replaced by what follows.
+"""
+
+import time
+from contextlib import closing
+
+from .llm_cache import make_key
+
+# Yielded in place of a chunk: drop the text streamed so far, a replacement follows
+RESTART = object()
+
+
+class GenerationTimings:
+    def __init__(self):
+        self.started_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        self.cancelled = False
+
+    def start(self):
+        self.started_at = time.perf_counter()
+
+    def mark_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def finish(self, cancelled=False):
+        self.finished_at = time.perf_counter()
+        self.cancelled = cancelled
+
+    @property
+    def time_to_first_token(self):
+        if self.started_at is None or self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def total_time(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def describe(self):
+        if self.started_at is None:
+            return "Served from cache"
+        if self.time_to_first_token is None:
+            return "No output received"
+        text = "First token after %.2fs, total %.2fs" % (self.time_to_first_token, self.total_time or 0.0)
+        if self.cancelled:
+            text += " (cancelled)"
+        return text
+
+
+def cancel_stream(response):
+    if callable(getattr(response, "cancel", None)):
+        response.cancel()
+        return
+    # Gemini streams: the gRPC transport exposes cancel(), the REST transport a closable generator
+    iterator = getattr(response, "_iterator", None)
+    for name in ("cancel", "close"):
+        fn = getattr(iterator, name, None)
+        if callable(fn):
+            fn()
+            return
+
+
+def stream_text(model, prompt, timings=None):
+    timings = timings or GenerationTimings()
+    timings.start()
+    response = model.generate_content(prompt, stream=True)
+    completed = False
+    try:
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks carrying only a finish reason or safety ratings have no text
+                continue
+            if text:
+                timings.mark_token()
+                yield text
+        completed = True
+    finally:
+        timings.finish(cancelled=not completed)
+        if not completed:
+            cancel_stream(response)
+
+
+def cached_stream(cache, model_name, template_version, inputs, stream_fn, valid=None):
+    """Stream through `cache`: replay a cached response whole, or store the streamed one once complete.
+
+    A streamed response failing `valid(response)` is not stored.
+    """
+    key = make_key(model_name, template_version, *inputs)
+    cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    with closing(stream_fn()) as chunks:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    response = "".join(parts)
+    if valid is None or valid(response):
+        cache.put(key, model_name, template_version, response)
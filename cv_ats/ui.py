@@ -0,0 +1,259 @@
+"""The Streamlit page shared by app_1.py, app_2.py and app_3.py.
+
+Streamlit re-executes the app script on every interaction. The scripts
+only import this module and call `main(profile)`, so a rerun costs a
+`get_pipeline` lookup instead of rebuilding prompts and the model client.
+"""
+
+import os
+import time
+import uuid
+
+import streamlit as st
+
+from .edits import DEFAULT_OUTPUT, OUTPUT_MODES
+from .jobs import CANCELLED, FAILED, QUEUED, job_runner, watch, watch_parts
+from .keywords import analyze, display_term
+from .metrics import stage
+from .pdf_extract import PdfRejected
+from .pipeline import get_pipeline
+from .specific_modes import DEFAULT_MODE, MODES
+
+MAX_TARGETS = int(os.getenv("FANOUT_MAX_JOBS", "10"))
+
+
+def remember_job(name, job_id):
+    # Session state survives reruns; the URL also survives a reconnect
+    st.session_state[name] = job_id
+    st.query_params[name] = job_id
+
+
+def forget_job(name):
+    st.session_state.pop(name, None)
+    st.query_params.pop(name, None)
+
+
+def submitted_job(name, job_id):
+    """The job for the current inputs, if this browser submitted it."""
+    if job_id in (st.session_state.get(name), st.query_params.get(name)):
+        return job_runner.get(job_id)
+    return None
+
+
+def session_id():
+    # Identifies this browser session to the runner, so leaving a shared job doesn't cancel it for the others
+    return st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+
+def submit_job(name, job_id, run, label, profile):
+    # An identical request already running (another tab or user) is joined, not repeated
+    job_runner.submit(job_id, run, label=label, profile=profile, session=session_id())
+    remember_job(name, job_id)
+
+
+def cancel_button(job, name):
+    """Offer to cancel a running job; True once this session has stopped waiting for it."""
+    if job.finished or not st.button("Cancel", key="cancel_" + job.id):
+        return False
+    if job_runner.cancel(job.id, session_id()):
+        st.info("The enhancement was cancelled.")
+    else:
+        st.info("Another session is waiting for this result, so it keeps running for them.")
+    forget_job(name)
+    return True
+
+
+def progress(job):
+    # Changes on every poll, so each poll makes an st call and a Cancel click is acted on straight away
+    if job.status == QUEUED:
+        return "Waiting for a free worker (%.0fs)..." % (time.time() - job.submitted_at)
+    return "%s (%.0fs)..." % (job.step or "Working", time.time() - (job.started_at or job.submitted_at))
+
+
+def show_job(job, title, name):
+    # Polls the background job; a rerun in the meantime just starts polling it again
+    st.subheader(title)
+    if cancel_button(job, name):
+        return
+    step = st.empty()
+    output = st.empty()
+    last = None
+    with st.spinner("Improving your CV..."):
+        for text in watch(job):
+            step.caption(progress(job))
+            if text != last:
+                last = text
+                output.markdown(text)
+    step.empty()
+    if job.status == CANCELLED:
+        output.info("The enhancement was cancelled.")
+        return
+    if job.status == FAILED:
+        output.error("The enhancement failed: %s" % job.error)
+        return
+    with stage("render"):
+        output.markdown(job.result)
+        for step_name, text in list(job.steps.items())[:-1]:
+            with st.expander(step_name):
+                st.write(text)
+    show_job_footer(job)
+
+
+def show_job_parts(job, names, title, name):
+    # The shared general pass streams first, then each job's tailoring streams into its own tab
+    st.subheader(title)
+    if cancel_button(job, name):
+        return
+    step = st.empty()
+    general = st.empty()
+    placeholders = [tab.empty() for tab in st.tabs(names)]
+    last_partial, last_parts = None, {}
+    with st.spinner("Tailoring your CV..."):
+        for partial, parts in watch_parts(job):
+            step.caption(progress(job))
+            if not parts and partial != last_partial:
+                general.markdown(partial)
+            for part, placeholder in zip(names, placeholders):
+                if parts.get(part) and parts[part] != last_parts.get(part):
+                    placeholder.markdown(parts[part])
+            last_partial, last_parts = partial, parts
+    step.empty()
+    general.empty()
+    if job.status == CANCELLED:
+        st.info("The enhancement was cancelled.")
+        return
+    if job.status == FAILED:
+        st.error("The enhancement failed: %s" % job.error)
+        return
+    with stage("render"):
+        if job.result:
+            with general.container():
+                with st.expander("General enhancement"):
+                    st.write(job.result)
+        for part, placeholder in zip(names, placeholders):
+            if part in job.part_errors:
+                placeholder.error("Tailoring for this job failed: %s" % job.part_errors[part])
+            else:
+                placeholder.markdown(job.part(part))
+    show_job_footer(job)
+
+
+def show_job_footer(job):
+    captions = ["%s: %s" % (name, timings.describe()) for name, timings in job.timings.items()]
+    if job.detail:
+        captions.append(job.detail)
+    if captions:
+        st.caption(" | ".join(captions))
+    if job.metrics is not None and job.metrics.profile_report:
+        with st.expander("Profile (%s)" % job.profile):
+            st.code(job.metrics.profile_report)
+
+
+def main(profile=None):
+    pipeline = get_pipeline(profile)
+    st.title("ATS-Friendly CV Improver")
+
+    st.subheader("Upload your CV (PDF format):")
+    pdf_file = st.file_uploader("Choose a PDF file", type="pdf")
+    stream_output = st.sidebar.checkbox("Stream responses", value=True)
+    specific_mode = st.sidebar.selectbox("Specific enhancement mode", MODES, index=MODES.index(DEFAULT_MODE))
+    by_section = st.sidebar.checkbox("Only re-enhance changed sections", value=False)
+    output = st.sidebar.selectbox(
+        "General enhancement output", OUTPUT_MODES, index=OUTPUT_MODES.index(DEFAULT_OUTPUT),
+        help="edits: the model lists targeted edits instead of rewriting the whole CV, which is faster for long CVs",
+    )
+    profiler = st.sidebar.selectbox("Profile the next request", ("off", "cprofile", "tracemalloc"))
+    profiler = None if profiler == "off" else profiler
+
+    cv_text = None
+    if pdf_file is not None:
+        try:
+            with st.spinner("Extracting text from PDF..."):
+                cv_text = pipeline.extract_text_from_pdf(pdf_file)
+        except PdfRejected as exc:
+            st.error(str(exc))
+
+    if cv_text is not None:
+        if pipeline.profile.show_extracted_text:
+            st.text_area("Extracted CV Text:", value=cv_text, height=300, key="cv_text_area")
+
+        option = st.selectbox("Choose an option:", ("General CV Enhancement", "Specific Job Description Enhancement"))
+
+        if option == "General CV Enhancement":
+            if by_section:
+                sections = pipeline.extract_sections_from_pdf(pdf_file)
+                job_id = pipeline.sections_job_id(sections)
+                run = lambda job: pipeline.run_sections_job(job, sections)
+            else:
+                job_id = pipeline.general_job_id(cv_text, output)
+                run = lambda job: pipeline.run_general_job(job, cv_text, stream_output, output)
+            if st.button("Improve CV"):
+                submit_job("general_job", job_id, run, "general", profiler)
+            job = submitted_job("general_job", job_id)
+            if job is not None:
+                show_job(job, "Improved CV and Suggestions:", "general_job")
+        else:
+            count = st.number_input("Number of job descriptions:", min_value=1, max_value=MAX_TARGETS, value=1)
+            if count > 1:
+                show_specific_many(pipeline, cv_text, count, specific_mode, stream_output, profiler)
+            else:
+                show_specific(pipeline, cv_text, specific_mode, stream_output, profiler)
+
+    show_about(pipeline)
+
+
+def show_specific(pipeline, cv_text, specific_mode, stream_output, profiler):
+    job_description = st.text_area("Enter the job description:", height=150)
+    minimum_qualification = st.text_area("Enter the minimum qualification:", height=50)
+    show_coverage(cv_text, job_description, minimum_qualification)
+    job_id = pipeline.specific_job_id(cv_text, job_description, minimum_qualification, specific_mode)
+    if st.button("Improve CV for Specific Job"):
+        if job_description and minimum_qualification:
+            submit_job("specific_job", job_id, lambda job: pipeline.run_specific_job(
+                job, cv_text, job_description, minimum_qualification, specific_mode, stream_output
+            ), "specific", profiler)
+        else:
+            st.warning("Please enter both job description and minimum qualification.")
+    job = submitted_job("specific_job", job_id)
+    if job is not None:
+        show_job(job, "Improved CV and Suggestions for Specific Job:", "specific_job")
+
+
+def show_coverage(cv_text, job_description, minimum_qualification):
+    if job_description and minimum_qualification:
+        # Local analysis, shown before any model call is made
+        coverage = analyze(cv_text, job_description, minimum_qualification)
+        st.metric("ATS keyword coverage", "%.0f%%" % (coverage.coverage * 100))
+        if coverage.missing:
+            st.caption("Missing keywords: " + ", ".join(display_term(term) for term in coverage.missing))
+
+
+def show_specific_many(pipeline, cv_text, count, specific_mode, stream_output, profiler):
+    # One CV, many jobs: the general pass runs once and the tailoring calls run side by side
+    names = ["Job %d" % (i + 1) for i in range(count)]
+    targets = []
+    for i, tab in enumerate(st.tabs(names)):
+        with tab:
+            job_description = st.text_area("Enter the job description:", height=150, key="job_description_%d" % i)
+            minimum_qualification = st.text_area(
+                "Enter the minimum qualification:", height=50, key="minimum_qualification_%d" % i
+            )
+            show_coverage(cv_text, job_description, minimum_qualification)
+        targets.append((job_description, minimum_qualification))
+    job_id = pipeline.specific_many_job_id(cv_text, targets, specific_mode)
+    if st.button("Improve CV for All %d Jobs" % count):
+        if all(job_description and minimum_qualification for job_description, minimum_qualification in targets):
+            submit_job("specific_many_job", job_id, lambda job: pipeline.run_specific_many_job(
+                job, cv_text, targets, names, specific_mode, stream_output
+            ), "specific-many", profiler)
+        else:
+            st.warning("Please enter a job description and minimum qualification for every job.")
+    job = submitted_job("specific_many_job", job_id)
+    if job is not None:
+        show_job_parts(job, names, "Improved CV and Suggestions per Job:", "specific_many_job")
+
+
+def show_about(pipeline):
+    if pipeline.profile.about:
+        st.sidebar.header("About")
+        st.sidebar.info(pipeline.profile.about)